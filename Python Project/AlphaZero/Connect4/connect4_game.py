@@ -24,24 +24,55 @@ class Connect4Board(Board):
         :param start_player: 为0表示第一个玩家先手，为1表示第二个玩家先手
         """
         self.current_player = self.players[start_player]
+        self.init_hash(self.width * self.height)
         self.states = {}
+        self.planes = {player: np.zeros((self.height, self.width)) for player in self.players}  # 每个玩家的所有棋子，随动作更新
         self.last_move = -1
+        self.history = []  # 执行过的动作，用来撤销
 
-    def current_state(self):
+    def current_state(self, out=None):
         """
         返回以当前玩家的视角看到的棋盘状态（神经网络的输入）。
+        :param out: 形状为3*height*width的数组，传入时棋盘状态直接写到这个数组里，不再分配新的数组
         :return: 3*height*width
         """
-        square_state = np.zeros((3, self.height, self.width))
-        if self.states:
-            moves, players = np.array(list(zip(*self.states.items())))
-            move_curr = moves[players == self.current_player]
-            move_oppo = moves[players != self.current_player]
-            square_state[0][move_curr // self.width, move_curr % self.width] = 1.0  # 所有自己棋子
-            square_state[1][move_oppo // self.width, move_oppo % self.width] = 1.0  # 所有对手棋子
-        if len(self.states) % 2 == 0:
-            square_state[2][:, :] = 1.0  # 区分自己棋子颜色
-        return square_state[:, ::-1, :]
+        if out is None:
+            out = np.empty((3, self.height, self.width))
+        opponent = self.players[0] if self.current_player == self.players[1] else self.players[1]
+        out[0] = self.planes[self.current_player][::-1]  # 所有自己棋子
+        out[1] = self.planes[opponent][::-1]  # 所有对手棋子
+        out[2] = 1.0 if len(self.states) % 2 == 0 else 0.0  # 区分自己棋子颜色
+        return out
+
+    def _pop_planes(self, column):
+        """
+        弹出棋子后把两个玩家在这一列的棋子都往下移一格。
+        :param column: 列
+        """
+        for plane in self.planes.values():
+            plane[:-1, column] = plane[1:, column]
+            plane[-1, column] = 0.0
+
+    def _set_planes_column(self, column, players):
+        """
+        把两个玩家在这一列的棋子设置成players。
+        :param column: 列
+        :param players: 这一列从下往上所有棋子所属的玩家编号
+        """
+        for player, plane in self.planes.items():
+            plane[:, column] = 0.0
+            plane[:len(players), column] = [1.0 if p == player else 0.0 for p in players]
+
+    def _column_hash(self, column, players):
+        """
+        :param column: 列
+        :param players: 这一列从下往上所有棋子所属的玩家编号
+        :return: 这一列所有棋子对应的Zobrist随机数的异或
+        """
+        column_hash = 0
+        for i, player in enumerate(players):
+            column_hash ^= self.zobrist[player][column + i * self.width]
+        return column_hash
 
     def __move_to_location(self, move):
         if move < self.width:
@@ -57,8 +88,16 @@ class Connect4Board(Board):
         :param move: 动作值
         """
         if move < self.width:
-            self.states[self.__move_to_location(move)] = self.current_player
+            loc = self.__move_to_location(move)
+            self.history.append((move, loc, self.last_move))
+            self.states[loc] = self.current_player
+            self.planes[self.current_player][loc // self.width, loc % self.width] = 1.0
+            self.zobrist_hash ^= self.zobrist[self.current_player][loc]
         else:
+            column = move - self.width
+            players = [self.states[loc] for loc in range(column, self.width * self.height, self.width) if loc in self.states]
+            self.history.append((move, players, self.last_move))  # 弹出前这一列从下往上的所有棋子
+            self.zobrist_hash ^= self._column_hash(column, players) ^ self._column_hash(column, players[1:])
             for loc in range(move - self.width, self.width * self.height, self.width):
                 if loc not in self.states:
                     break
@@ -66,10 +105,34 @@ class Connect4Board(Board):
                     self.states.pop(loc)
                 else:
                     self.states[loc] = self.states[loc + self.width]
+            self._pop_planes(column)
 
+        self.zobrist_hash ^= self.zobrist_player
         self.current_player = (self.players[0] if self.current_player == self.players[1] else self.players[1])  # 切换到另一个玩家
         self.last_move = move
 
+    def can_undo(self):
+        return True
+
+    def undo_move(self):
+        """
+        撤销最近一次do_move执行的动作。
+        """
+        move, record, last_move = self.history.pop()
+        if move < self.width:  # 撤销落子，record是落子的位置
+            self.zobrist_hash ^= self.zobrist[self.states.pop(record)][record]
+            for plane in self.planes.values():
+                plane[record // self.width, record % self.width] = 0.0
+        else:  # 撤销弹出，record是弹出前这一列的所有棋子
+            column = move - self.width
+            for i, player in enumerate(record):
+                self.states[column + i * self.width] = player
+            self._set_planes_column(column, record)
+            self.zobrist_hash ^= self._column_hash(column, record) ^ self._column_hash(column, record[1:])
+        self.zobrist_hash ^= self.zobrist_player
+        self.current_player = (self.players[0] if self.current_player == self.players[1] else self.players[1])
+        self.last_move = last_move
+
     def __has_a_winner(self):
         """
         判断游戏是否结束。
@@ -168,6 +231,135 @@ class Connect4Board(Board):
         return availables
 
 
+class Connect4BitBoard(Connect4Board):
+    """
+    用位棋盘实现的四子棋棋盘，规则（包括弹出棋子和双方同时连成四子算平局）和Connect4Board完全相同，可以直接代替Connect4Board。
+    每个玩家的棋子存成一个整数，按列存放，每列height个位后面多留一个总是为0的位，这样移位判断四子连线时不会从一列绕到另一列。
+    """
+
+    def init_board(self, start_player=0):
+        """
+        初始化棋盘。
+        :param start_player: 为0表示第一个玩家先手，为1表示第二个玩家先手
+        """
+        Connect4Board.init_board(self, start_player)
+        self.stride = self.height + 1  # 每列多留一位
+        self.directions = [1, self.stride, self.stride + 1, self.stride - 1]  # 竖，横，右上，左上四个方向的移位距离
+        self.column_mask = (1 << self.height) - 1
+        self.bits = {player: 0 for player in self.players}  # 每个玩家的位棋盘
+        self.heights = [0] * self.width  # 每列的棋子数量
+        self.end_cache = None
+        self.availables_cache = None
+
+    def do_move(self, move):
+        """
+        当前玩家执行动作值为move的动作。
+        :param move: 动作值
+        """
+        player = self.current_player
+        if move < self.width:  # 落子
+            height = self.heights[move]
+            loc = move + height * self.width
+            self.history.append((move, loc, self.last_move))
+            self.states[loc] = player
+            self.planes[player][height, move] = 1.0
+            self.zobrist_hash ^= self.zobrist[player][loc]
+            self.bits[player] |= 1 << (move * self.stride + height)
+            self.heights[move] = height + 1
+        else:  # 弹出这一列最下面的棋子，上面的棋子都往下掉一格
+            column = move - self.width
+            height = self.heights[column]
+            players = [self.states[column + i * self.width] for i in range(height)]
+            self.history.append((move, players, self.last_move))
+            self.zobrist_hash ^= self._column_hash(column, players) ^ self._column_hash(column, players[1:])
+            for i in range(height - 1):
+                self.states[column + i * self.width] = self.states[column + (i + 1) * self.width]
+            del self.states[column + (height - 1) * self.width]
+            self._pop_planes(column)
+            shift = column * self.stride
+            for p in self.players:
+                bits = self.bits[p]
+                column_bits = (bits >> shift) & self.column_mask
+                self.bits[p] = (bits & ~(self.column_mask << shift)) | ((column_bits >> 1) << shift)
+            self.heights[column] = height - 1
+        self.zobrist_hash ^= self.zobrist_player
+        self.current_player = (self.players[0] if player == self.players[1] else self.players[1])  # 切换到另一个玩家
+        self.last_move = move
+        self.end_cache = None
+        self.availables_cache = None
+
+    def undo_move(self):
+        """
+        撤销最近一次do_move执行的动作。
+        """
+        move, record, last_move = self.history.pop()
+        self.current_player = (self.players[0] if self.current_player == self.players[1] else self.players[1])
+        if move < self.width:  # 撤销落子，record是落子的位置
+            del self.states[record]
+            self.zobrist_hash ^= self.zobrist[self.current_player][record]
+            self.heights[move] -= 1
+            self.planes[self.current_player][self.heights[move], move] = 0.0
+            self.bits[self.current_player] &= ~(1 << (move * self.stride + self.heights[move]))
+        else:  # 撤销弹出，record是弹出前这一列从下往上的所有棋子
+            column = move - self.width
+            shift = column * self.stride
+            for p in self.players:
+                self.bits[p] &= ~(self.column_mask << shift)
+            for i, p in enumerate(record):
+                self.states[column + i * self.width] = p
+                self.bits[p] |= 1 << (shift + i)
+            self._set_planes_column(column, record)
+            self.zobrist_hash ^= self._column_hash(column, record) ^ self._column_hash(column, record[1:])
+            self.heights[column] = len(record)
+        self.zobrist_hash ^= self.zobrist_player
+        self.last_move = last_move
+        self.end_cache = None
+        self.availables_cache = None
+
+    def __is_in_row(self, bits):
+        """
+        用移位判断位棋盘上有没有连成四子。
+        :param bits: 一个玩家的位棋盘
+        :return: 是否连成了四子
+        """
+        for direction in self.directions:
+            pairs = bits & (bits >> direction)
+            if pairs & (pairs >> (2 * direction)):
+                return True
+        return False
+
+    def game_end(self):
+        """
+        检查游戏是否结束。
+        :return: 返回游戏是否结束的bool值和赢了的玩家编号，玩家编号为-1表示没有人赢。
+        """
+        if self.end_cache is None:
+            winners = []
+            if len(self.states) >= self.n_in_row + 2:  # 和Connect4Board一样，棋子太少时不判断输赢
+                winners = [p for p in self.players if self.__is_in_row(self.bits[p])]
+            if len(winners) == 1:  # 玩家winnner赢了
+                self.end_cache = True, winners[0]
+            elif len(winners) == 2:  # 弹出棋子后双方同时连成四子，平局
+                self.end_cache = True, -1
+            elif not len(self.get_available_moves()):  # 平局
+                self.end_cache = True, -1
+            else:  # 还没结束
+                self.end_cache = False, -1
+        return self.end_cache
+
+    def get_available_moves(self):
+        """
+        :return: 能走的动作列表
+        """
+        if self.availables_cache is None:
+            availables = [move for move in range(self.width) if self.heights[move] < self.height]
+            bits = self.bits[self.current_player]
+            availables.extend(self.width + column for column in range(self.width)
+                              if (bits >> (column * self.stride)) & 1)
+            self.availables_cache = availables
+        return self.availables_cache
+
+
 class Connect4Game(Game):
     """
     五子棋游戏。
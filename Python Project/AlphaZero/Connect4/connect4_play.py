@@ -32,7 +32,7 @@ class Human(Player):
 
 
 def human_versus_ai():
-    board = Connect4Board()
+    board = Connect4BitBoard()
     game = Connect4Game(board)
     policy_value_net = Connect4PolicyValueNet(model_file="model/300/policy_value_net.model")
     try:
@@ -25,9 +25,12 @@ class GobangBoard(Board):
         if self.width < self.n_in_row:
             raise Exception('棋盘的长和宽不能小于{}'.format(self.n_in_row))
         self.current_player = self.players[start_player]
+        self.init_hash(self.width * self.width)
         self.availables = list(range(self.width * self.width))  # 可以走的动作
         self.states = {}
+        self.planes = {player: np.zeros((self.width, self.width)) for player in self.players}  # 每个玩家的所有棋子，随动作更新
         self.last_move = -1
+        self.history = []  # 执行过的动作，用来撤销
 
     def move_to_location(self, move):
         """
@@ -54,33 +57,59 @@ class GobangBoard(Board):
             return -1
         return move
 
-    def current_state(self):
+    def current_state(self, out=None):
         """
         返回以当前玩家的视角看到的棋盘状态（神经网络的输入）。
+        :param out: 形状为4*width*width的数组，传入时棋盘状态直接写到这个数组里，不再分配新的数组
         :return: 4*width*width
         """
-        square_state = np.zeros((4, self.width, self.width))
+        if out is None:
+            out = np.empty((4, self.width, self.width))
+        opponent = self.players[0] if self.current_player == self.players[1] else self.players[1]
+        out[0] = self.planes[self.current_player][::-1]  # 所有自己棋子
+        out[1] = self.planes[opponent][::-1]  # 所有对手棋子
+        out[2] = 0.0
         if self.states:
-            moves, players = np.array(list(zip(*self.states.items())))
-            move_curr = moves[players == self.current_player]
-            move_oppo = moves[players != self.current_player]
-            square_state[0][move_curr // self.width, move_curr % self.width] = 1.0  # 所有自己棋子
-            square_state[1][move_oppo // self.width, move_oppo % self.width] = 1.0  # 所有对手棋子
-            square_state[2][self.last_move // self.width, self.last_move % self.width] = 1.0  # 上一步棋子落点
-        if len(self.states) % 2 == 0:
-            square_state[3][:, :] = 1.0  # 区分自己棋子颜色
-        return square_state[:, ::-1, :]
+            out[2][self.width - 1 - self.last_move // self.width, self.last_move % self.width] = 1.0  # 上一步棋子落点
+        out[3] = 1.0 if len(self.states) % 2 == 0 else 0.0  # 区分自己棋子颜色
+        return out
 
     def do_move(self, move):
         """
         当前玩家执行动作值为move的动作。
         :param move: 动作值
         """
+        index = self.availables.index(move)
+        self.history.append((move, index, self.last_move))
         self.states[move] = self.current_player
-        self.availables.remove(move)
+        self.planes[self.current_player][move // self.width, move % self.width] = 1.0
+        self.zobrist_hash ^= self.zobrist[self.current_player][move] ^ self.zobrist_player
+        del self.availables[index]
         self.current_player = (self.players[0] if self.current_player == self.players[1] else self.players[1])  # 切换到另一个玩家
         self.last_move = move
 
+    def can_undo(self):
+        return True
+
+    def undo_move(self):
+        """
+        撤销最近一次do_move执行的动作。
+        """
+        move, index, last_move = self.history.pop()
+        del self.states[move]
+        self.availables.insert(index, move)  # 放回原来的位置，保持可以走的动作的顺序不变
+        self.current_player = (self.players[0] if self.current_player == self.players[1] else self.players[1])
+        self.planes[self.current_player][move // self.width, move % self.width] = 0.0
+        self.zobrist_hash ^= self.zobrist[self.current_player][move] ^ self.zobrist_player
+        self.last_move = last_move
+
+    def get_evaluation_key(self):
+        """
+        神经网络的输入包括上一步落子位置，所以缓存键是局面的哈希值和上一步落子位置。
+        :return: 缓存键
+        """
+        return self.get_hash(), self.last_move
+
     def __has_a_winner(self):
         """
         判断游戏是否结束。
@@ -149,6 +178,113 @@ class GobangBoard(Board):
         return self.availables
 
 
+class GobangBitBoard(GobangBoard):
+    """
+    用位棋盘实现的五子棋棋盘，接口和GobangBoard完全相同，current_state()也完全相同，可以直接代替GobangBoard。
+    每个玩家的棋子存成一个整数，每一行后面多留一个总是为0的位，这样沿某个方向移位时不会从棋盘一边绕到另一边。
+    每次落子后只检查经过这个棋子的四条线，可以走的动作存成一个bool数组。
+    """
+
+    def init_board(self, start_player=0):
+        """
+        初始化棋盘。
+        :param start_player: 为0表示第一个玩家先手，为1表示第二个玩家先手
+        """
+        if self.width < self.n_in_row:
+            raise Exception('棋盘的长和宽不能小于{}'.format(self.n_in_row))
+        self.current_player = self.players[start_player]
+        self.init_hash(self.width * self.width)
+        self.states = {}
+        self.planes = {player: np.zeros((self.width, self.width)) for player in self.players}  # 每个玩家的所有棋子，随动作更新
+        self.last_move = -1
+        self.history = []  # 执行过的动作，用来撤销
+        stride = self.width + 1  # 每行多留一位
+        self.bits = {player: 0 for player in self.players}  # 每个玩家的位棋盘
+        self.bit_index = [h * stride + w for h in range(self.width) for w in range(self.width)]  # 动作值对应的位
+        self.directions = [1, stride, stride + 1, stride - 1]  # 横，竖，右上，左上四个方向的移位距离
+        self.available_mask = np.ones(self.width * self.width, dtype=bool)  # 可以走的动作
+        self.availables_cache = None
+        self.winner = -1
+
+    @property
+    def availables(self):
+        return self.get_available_moves()
+
+    def do_move(self, move):
+        """
+        当前玩家执行动作值为move的动作，并检查这个动作有没有连成n_in_row个棋子。
+        :param move: 动作值
+        """
+        player = self.current_player
+        self.history.append((move, self.last_move, self.winner))
+        self.states[move] = player
+        self.planes[player][move // self.width, move % self.width] = 1.0
+        self.zobrist_hash ^= self.zobrist[player][move] ^ self.zobrist_player
+        self.available_mask[move] = False
+        self.availables_cache = None
+        bits = self.bits[player] | (1 << self.bit_index[move])
+        self.bits[player] = bits
+        if self.__is_in_row(bits, self.bit_index[move]):
+            self.winner = player
+        self.current_player = (self.players[0] if player == self.players[1] else self.players[1])  # 切换到另一个玩家
+        self.last_move = move
+
+    def __is_in_row(self, bits, index):
+        """
+        判断位置index的棋子在某个方向上是不是连成了n_in_row个棋子。
+        :param bits: 棋子所属玩家的位棋盘
+        :param index: 棋子的位
+        :return: 是否连成了n_in_row个棋子
+        """
+        for direction in self.directions:
+            count = 1
+            i = index + direction
+            while (bits >> i) & 1:
+                count += 1
+                i += direction
+            i = index - direction
+            while i >= 0 and (bits >> i) & 1:
+                count += 1
+                i -= direction
+            if count >= self.n_in_row:
+                return True
+        return False
+
+    def undo_move(self):
+        """
+        撤销最近一次do_move执行的动作。
+        """
+        move, last_move, winner = self.history.pop()
+        self.current_player = (self.players[0] if self.current_player == self.players[1] else self.players[1])
+        del self.states[move]
+        self.planes[self.current_player][move // self.width, move % self.width] = 0.0
+        self.bits[self.current_player] &= ~(1 << self.bit_index[move])
+        self.zobrist_hash ^= self.zobrist[self.current_player][move] ^ self.zobrist_player
+        self.available_mask[move] = True
+        self.availables_cache = None
+        self.last_move = last_move
+        self.winner = winner
+
+    def game_end(self):
+        """
+        检查游戏是否结束。
+        :return: 返回游戏是否结束的bool值和赢了的玩家编号，玩家编号为-1表示没有人赢。
+        """
+        if self.winner != -1:  # 玩家winnner赢了
+            return True, self.winner
+        elif len(self.states) == self.width * self.width:  # 平局
+            return True, -1
+        return False, -1  # 还没结束
+
+    def get_available_moves(self):
+        """
+        :return: 能走的动作列表
+        """
+        if self.availables_cache is None:
+            self.availables_cache = np.flatnonzero(self.available_mask).tolist()
+        return self.availables_cache
+
+
 class GobangGame(Game):
     """
     五子棋游戏。
@@ -1,5 +1,5 @@
 from play import Player, MCTSPlayer
-from Gobang.gobang_game import GobangBoard, GobangGame
+from Gobang.gobang_game import GobangBitBoard, GobangGame
 from Gobang.gobang_model import *
 
 
@@ -31,7 +31,7 @@ class Human(Player):
 
 
 def human_versus_ai():
-    board = GobangBoard(width=10, n_in_row=5)
+    board = GobangBitBoard(width=10, n_in_row=5)
     game = GobangGame(board)
     policy_value_net = GobangPolicyValueNet2(board_width=10, model_file="model2_10_10_5/7950/policy_value_net.model")
     try:
@@ -42,7 +42,7 @@ def human_versus_ai():
 
 
 def test_ai():
-    board = GobangBoard(width=10, n_in_row=5)
+    board = GobangBitBoard(width=10, n_in_row=5)
     game = GobangGame(board)
     policy_value_net = GobangPolicyValueNet2(10, "model2_10_10_5/10000/policy_value_net.model")
     policy_value_net2 = GobangPretrainedPolicyValueNet(10, "model_10_10_5/15800/graph.bytes")
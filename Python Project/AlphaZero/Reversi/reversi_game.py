@@ -26,7 +26,14 @@ class ReversiBoard(Board):
         middle = self.width // 2
         self.states = {self.location_to_move([middle-1, middle-1]): self.current_player, self.location_to_move([middle, middle]): self.current_player,
                        self.location_to_move([middle-1, middle]): opponent, self.location_to_move([middle, middle-1]): opponent}
+        self.init_hash(self.width * self.width)
+        for move, player in self.states.items():
+            self.zobrist_hash ^= self.zobrist[player][move]
+        self.planes = {player: np.zeros((self.width, self.width)) for player in self.players}  # 每个玩家的所有棋子，随动作更新
+        for move, player in self.states.items():
+            self.planes[player][move // self.width, move % self.width] = 1.0
         self.last_move = -1
+        self.history = []  # 执行过的动作，用来撤销
 
     def move_to_location(self, move):
         """
@@ -53,21 +60,42 @@ class ReversiBoard(Board):
             return -1
         return move
 
-    def current_state(self):
+    def current_state(self, out=None):
         """
         返回以当前玩家的视角看到的棋盘状态（神经网络的输入）。
+        :param out: 形状为3*width*width的数组，传入时棋盘状态直接写到这个数组里，不再分配新的数组
         :return: 3*width*width
         """
-        square_state = np.zeros((3, self.width, self.width))
-        if self.states:
-            moves, players = np.array(list(zip(*self.states.items())))
-            move_curr = moves[players == self.current_player]
-            move_oppo = moves[players != self.current_player]
-            square_state[0][move_curr // self.width, move_curr % self.width] = 1.0  # 所有自己棋子
-            square_state[1][move_oppo // self.width, move_oppo % self.width] = 1.0  # 所有对手棋子
-        if len(self.states) % 2 == 0:
-            square_state[2][:, :] = 1.0  # 区分自己棋子颜色
-        return square_state[:, ::-1, :]
+        if out is None:
+            out = np.empty((3, self.width, self.width))
+        opponent = self.players[0] if self.current_player == self.players[1] else self.players[1]
+        out[0] = self.planes[self.current_player][::-1]  # 所有自己棋子
+        out[1] = self.planes[opponent][::-1]  # 所有对手棋子
+        out[2] = 1.0 if len(self.states) % 2 == 0 else 0.0  # 区分自己棋子颜色
+        return out
+
+    def _set_planes(self, moves, player, opponent):
+        """
+        把这些位置的棋子在特征平面上设置成玩家player的。
+        :param moves: 动作值列表
+        :param player: 棋子新的主人
+        :param opponent: 棋子原来的主人，为None表示原来是空位置
+        """
+        rows = [move // self.width for move in moves]
+        columns = [move % self.width for move in moves]
+        self.planes[player][rows, columns] = 1.0
+        if opponent is not None:
+            self.planes[opponent][rows, columns] = 0.0
+
+    def _flip_hash(self, moves):
+        """
+        :param moves: 被翻转的棋子的动作值列表
+        :return: 翻转这些棋子时局面的Zobrist哈希值要异或上的值
+        """
+        flip_hash = 0
+        for move in moves:
+            flip_hash ^= self.zobrist[self.players[0]][move] ^ self.zobrist[self.players[1]][move]
+        return flip_hash
 
     def __search(self, player, h, w, reverse = False):
         """
@@ -76,7 +104,7 @@ class ReversiBoard(Board):
         :param h: 纵轴位置
         :param w: 横轴位置
         :param reverse: 是否将找到的所有对手的能翻转的棋子变成player的棋子
-        :return: 能不能下子
+        :return: 所有能翻转的对手棋子列表，为空表示不能下子
         """
         all_opponent_moves = []
 
@@ -104,25 +132,49 @@ class ReversiBoard(Board):
         find(zip(range(w - 1, -1, -1), range(h - 1, -1, -1)))  # 往左下找
         find(zip(range(w + 1, self.width), range(h - 1, -1, -1)))  # 往右下找
 
-        if len(all_opponent_moves) == 0:
-            return False
         if reverse:
             for move in all_opponent_moves:
                 self.states[move] = player
-        return True
+        return all_opponent_moves
 
     def do_move(self, move):
         """
         当前玩家执行动作值为move的动作。
         :param move: 动作值
         """
+        reversed_moves = []
         if move != self.width * self.width:  # 最后一个动作是不下子
             self.states[move] = self.current_player
             loc = self.move_to_location(move)
-            self.__search(self.current_player, loc[0], loc[1], reverse=True)
+            reversed_moves = self.__search(self.current_player, loc[0], loc[1], reverse=True)
+            self._set_planes([move], self.current_player, None)
+            self._set_planes(reversed_moves, self.current_player, self.players[0] if self.current_player == self.players[1] else self.players[1])
+            self.zobrist_hash ^= self.zobrist[self.current_player][move] ^ self._flip_hash(reversed_moves)
+        self.zobrist_hash ^= self.zobrist_player
+        self.history.append((move, reversed_moves, self.last_move))
         self.current_player = (self.players[0] if self.current_player == self.players[1] else self.players[1])  # 切换到另一个玩家
         self.last_move = move
 
+    def can_undo(self):
+        return True
+
+    def undo_move(self):
+        """
+        撤销最近一次do_move执行的动作，被翻转的棋子翻回去。
+        """
+        move, reversed_moves, last_move = self.history.pop()
+        if move != self.width * self.width:
+            del self.states[move]
+            for reversed_move in reversed_moves:
+                self.states[reversed_move] = self.current_player  # 撤销前的当前玩家就是被翻转棋子的主人
+            mover = self.players[0] if self.current_player == self.players[1] else self.players[1]
+            self.planes[mover][move // self.width, move % self.width] = 0.0
+            self._set_planes(reversed_moves, self.current_player, mover)
+            self.zobrist_hash ^= self.zobrist[mover][move] ^ self._flip_hash(reversed_moves)
+        self.zobrist_hash ^= self.zobrist_player
+        self.current_player = (self.players[0] if self.current_player == self.players[1] else self.players[1])
+        self.last_move = last_move
+
     def game_end(self):
         """
         检查游戏是否结束。
@@ -179,6 +231,166 @@ class ReversiBoard(Board):
         return self.__get_available_moves(self.current_player)
 
 
+class ReversiBitBoard(ReversiBoard):
+    """
+    用位棋盘实现的翻转棋棋盘，规则（包括动作值为width*width的不下子动作）和ReversiBoard完全相同，可以直接代替ReversiBoard。
+    每个玩家的棋子存成一个整数，每一行后面多留一个总是为0的位，这样沿八个方向移位时不会从棋盘一边绕到另一边。
+    能走的动作用移位一次算出所有位置，并且双方的结果都缓存到下一次执行或撤销动作为止。
+    """
+
+    def init_board(self, start_player=0):
+        """
+        初始化棋盘。
+        :param start_player: 为0表示第一个玩家先手，为1表示第二个玩家先手
+        """
+        ReversiBoard.init_board(self, start_player)
+        stride = self.width + 1  # 每行多留一位
+        self.bit_index = [h * stride + w for h in range(self.width) for w in range(self.width)]  # 动作值对应的位
+        self.index_move = {index: move for move, index in enumerate(self.bit_index)}  # 位对应的动作值
+        self.full_mask = sum(1 << index for index in self.bit_index)  # 所有棋盘上的位
+        self.directions = [1, -1, stride, -stride, stride + 1, -stride - 1, stride - 1, -stride + 1]  # 八个方向的移位距离
+        self.bits = {player: 0 for player in self.players}  # 每个玩家的位棋盘
+        for move, player in self.states.items():
+            self.bits[player] |= 1 << self.bit_index[move]
+        self.moves_cache = {}  # 键是玩家编号，值是这个玩家能走的位置的位棋盘
+
+    def __shift(self, bits, direction):
+        """
+        把位棋盘往某个方向移一格，移出棋盘的位被丢掉。
+        :param bits: 位棋盘
+        :param direction: 移位距离，正数往左移，负数往右移
+        :return: 移位后的位棋盘
+        """
+        if direction > 0:
+            return (bits << direction) & self.full_mask
+        return bits >> -direction
+
+    def __legal_bits(self, player):
+        """
+        一次算出玩家player能下子的所有位置。
+        :param player: 玩家编号
+        :return: 能下子的位置的位棋盘
+        """
+        if player not in self.moves_cache:
+            own = self.bits[player]
+            opponent = self.bits[self.players[0] if player == self.players[1] else self.players[1]]
+            empty = self.full_mask & ~(own | opponent)
+            legal = 0
+            for direction in self.directions:
+                line = self.__shift(own, direction) & opponent  # 从自己的棋子出发，沿这个方向连续的对手棋子
+                for i in range(self.width - 3):
+                    line |= self.__shift(line, direction) & opponent
+                legal |= self.__shift(line, direction) & empty
+            self.moves_cache[player] = legal
+        return self.moves_cache[player]
+
+    def __flips(self, player, index):
+        """
+        找到玩家player在位置index下子后能翻转的所有对手棋子。
+        :param player: 玩家编号
+        :param index: 下子位置的位
+        :return: 能翻转的对手棋子的位棋盘
+        """
+        own = self.bits[player]
+        opponent = self.bits[self.players[0] if player == self.players[1] else self.players[1]]
+        flips = 0
+        for direction in self.directions:
+            line = 0
+            bit = self.__shift(1 << index, direction)
+            while bit & opponent:
+                line |= bit
+                bit = self.__shift(bit, direction)
+            if bit & own:
+                flips |= line
+        return flips
+
+    def __bits_to_moves(self, bits):
+        """
+        :param bits: 位棋盘
+        :return: 位棋盘上所有位置的动作值，从小到大排列
+        """
+        moves = []
+        while bits:
+            lowest = bits & -bits
+            moves.append(self.index_move[lowest.bit_length() - 1])
+            bits ^= lowest
+        moves.sort()
+        return moves
+
+    def do_move(self, move):
+        """
+        当前玩家执行动作值为move的动作。
+        :param move: 动作值
+        """
+        player = self.current_player
+        opponent = self.players[0] if player == self.players[1] else self.players[1]
+        flips = 0
+        if move != self.width * self.width:  # 最后一个动作是不下子
+            index = self.bit_index[move]
+            flips = self.__flips(player, index)
+            self.bits[player] |= flips | (1 << index)
+            self.bits[opponent] &= ~flips
+            self.states[move] = player
+            flipped_moves = self.__bits_to_moves(flips)
+            for flipped_move in flipped_moves:
+                self.states[flipped_move] = player
+            self._set_planes([move], player, None)
+            self._set_planes(flipped_moves, player, opponent)
+            self.zobrist_hash ^= self.zobrist[player][move] ^ self._flip_hash(flipped_moves)
+        self.zobrist_hash ^= self.zobrist_player
+        self.history.append((move, flips, self.last_move))
+        self.current_player = opponent  # 切换到另一个玩家
+        self.last_move = move
+        self.moves_cache = {}
+
+    def undo_move(self):
+        """
+        撤销最近一次do_move执行的动作，被翻转的棋子翻回去。
+        """
+        move, flips, last_move = self.history.pop()
+        opponent = self.current_player  # 撤销前的当前玩家就是被翻转棋子的主人
+        player = self.players[0] if opponent == self.players[1] else self.players[1]
+        if move != self.width * self.width:
+            self.bits[player] &= ~(flips | (1 << self.bit_index[move]))
+            self.bits[opponent] |= flips
+            del self.states[move]
+            flipped_moves = self.__bits_to_moves(flips)
+            for flipped_move in flipped_moves:
+                self.states[flipped_move] = opponent
+            self.planes[player][move // self.width, move % self.width] = 0.0
+            self._set_planes(flipped_moves, opponent, player)
+            self.zobrist_hash ^= self.zobrist[player][move] ^ self._flip_hash(flipped_moves)
+        self.zobrist_hash ^= self.zobrist_player
+        self.current_player = player
+        self.last_move = last_move
+        self.moves_cache = {}
+
+    def game_end(self):
+        """
+        检查游戏是否结束，双方都只能不下子时游戏结束，棋子多的玩家赢。
+        :return: 返回游戏是否结束的bool值和赢了的玩家编号，玩家编号为-1表示没有人赢。
+        """
+        if self.__legal_bits(self.players[0]) or self.__legal_bits(self.players[1]):  # 还没结束
+            return False, -1
+        player1_count = bin(self.bits[self.players[0]]).count("1")
+        player2_count = bin(self.bits[self.players[1]]).count("1")
+        if player1_count > player2_count:  # 玩家一赢了
+            return True, self.players[0]
+        elif player1_count < player2_count:  # 玩家二赢了
+            return True, self.players[1]
+        else:  # 平局
+            return True, -1
+
+    def get_available_moves(self):
+        """
+        :return: 能走的动作列表，不能下子时只有动作width*width
+        """
+        legal = self.__legal_bits(self.current_player)
+        if not legal:
+            return [self.width * self.width]
+        return self.__bits_to_moves(legal)
+
+
 class ReversiGame(Game):
     """
     翻转棋游戏。
@@ -31,7 +31,7 @@ class Human(Player):
 
 
 def human_versus_ai():
-    board = ReversiBoard(width=4)
+    board = ReversiBitBoard(width=4)
     game = ReversiGame(board)
     policy_value_net = ReversiPolicyValueNet(board_width=4, model_file="model_4/200/policy_value_net.model")
     try:
@@ -42,7 +42,7 @@ def human_versus_ai():
 
 
 def test_ai():
-    board = ReversiBoard(width=8)
+    board = ReversiBitBoard(width=8)
     game = ReversiGame(board)
     policy_value_net = ReversiPolicyValueNet(8, "model_8_8_5/9000/policy_value_net.model")
     policy_value_net2 = ReversiPretrainedPolicyValueNet(8, "model_8_8_5/9100/graph.bytes")
@@ -0,0 +1,382 @@
+import copy
+import time
+import random
+import threading
+import tracemalloc
+import multiprocessing
+
+import numpy as np
+import tensorflow as tf
+from play import MCTSPlayer
+from game import Game
+from inference import InferenceServer
+from cache import EvaluationCache
+from symmetry import DihedralSymmetry, SymmetricPolicyValueNet
+from replay_buffer import ReplayBuffer
+from model import set_session_threads, freeze_graph_def, InferencePolicyValueNet
+from numpy_net import NumpyPolicyValueNet, QuantizedPolicyValueNet, compare_policy_value
+from collections import deque
+from Gobang.gobang_game import GobangBoard, GobangBitBoard
+from Gobang.gobang_model import GobangPolicyValueNet, GobangPolicyValueNet2
+from Connect4.connect4_game import Connect4Board, Connect4BitBoard
+from Connect4.connect4_model import Connect4PolicyValueNet
+from Reversi.reversi_game import ReversiBoard, ReversiBitBoard
+from Reversi.reversi_model import ReversiPolicyValueNet
+
+
+def create_games():
+    """
+    创建每个游戏的棋盘和随机初始化的神经网络，每个神经网络在自己的计算图里。
+    :return: (游戏名, 棋盘, 神经网络)列表
+    """
+    games = []
+    for name, board, create_net in [("Gobang", GobangBoard(width=10, n_in_row=5), lambda: GobangPolicyValueNet(10)),
+                                    ("Connect4", Connect4Board(), lambda: Connect4PolicyValueNet()),
+                                    ("Reversi", ReversiBoard(width=8), lambda: ReversiPolicyValueNet(8))]:
+        with tf.Graph().as_default():
+            games.append((name, board, create_net()))
+    return games
+
+
+def playouts_vs_batch_size(n_playout=400, n_moves=10, batch_sizes=(1, 2, 4, 8, 16, 32)):
+    """
+    比较不同batch_size下每个游戏MCTS每秒的搜索次数。
+    :param n_playout: 每步的蒙特卡洛搜索次数
+    :param n_moves: 每个游戏走多少步
+    :param batch_sizes: 要比较的batch_size
+    """
+    for name, board, net in create_games():
+        for batch_size in batch_sizes:
+            player = MCTSPlayer(net.policy_value_fn, n_playout=n_playout,
+                                policy_value_batch_function=net.policy_value, batch_size=batch_size)
+            board.init_board()
+            n = 0
+            start_time = time.time()
+            for i in range(n_moves):
+                if board.game_end()[0]:
+                    break
+                board.do_move(player.get_action(board))
+                n += n_playout
+            print("{} batch_size={}: {:.1f} playouts/s".format(name, batch_size, n / (time.time() - start_time)))
+
+
+def lockstep_selfplay(n_games=16, n_playout=200):
+    """
+    比较一局一局自我对局和n_games局同时自我对局每秒产生的棋局数。
+    :param n_games: 同时进行的局数
+    :param n_playout: 每步的蒙特卡洛搜索次数
+    """
+    for name, board, net in create_games():
+        game = Game(board)
+        player = MCTSPlayer(net.policy_value_fn, n_playout=n_playout, is_selfplay=True)
+        start_time = time.time()
+        n = sum(len(list(game.start_self_play(player, temp=1.0)[1])) for i in range(n_games))
+        print("{} sequential: {:.1f} positions/s".format(name, n / (time.time() - start_time)))
+
+        players = [MCTSPlayer(net.policy_value_fn, n_playout=n_playout, is_selfplay=True) for i in range(n_games)]
+        start_time = time.time()
+        n = sum(len(list(play_data)) for winner, play_data in game.start_self_play_batch(players, net.policy_value, temp=1.0))
+        print("{} lock-step n_games={}: {:.1f} positions/s".format(name, n_games, n / (time.time() - start_time)))
+
+
+def transposition_stats(n_playout=400, n_games=2):
+    """
+    用TranspositionMCTS自我对局，打印每个游戏置换表的平均命中率和每步省下的神经网络评估比例。
+    :param n_playout: 每步的蒙特卡洛搜索次数
+    :param n_games: 每个游戏自我对局的局数
+    """
+    for name, board, net in create_games():
+        game = Game(board)
+        player = MCTSPlayer(net.policy_value_fn, n_playout=n_playout, is_selfplay=True, transposition=True)
+        for i in range(n_games):
+            game.start_self_play(player, temp=1.0)
+        stats = player.mcts.move_stats
+        print("{}: hit_rate={:.3f}, nn_calls_saved={:.3f} per move over {} moves".format(
+            name, np.mean([s["hit_rate"] for s in stats]), np.mean([s["nn_calls_saved"] for s in stats]), len(stats)))
+
+
+def symmetry_savings(n_games=4, n_playout=400):
+    """
+    五子棋和翻转棋自我对局，比较只用EvaluationCache和再加上对称标准化时每局的神经网络评估次数。
+    :param n_games: 自我对局的局数
+    :param n_playout: 每步的蒙特卡洛搜索次数
+    """
+    for name, board, net in create_games():
+        if name == "Connect4":  # 四子棋的棋盘不是正方形
+            continue
+        game = Game(board)
+        cache = EvaluationCache(net)
+        player = MCTSPlayer(cache.policy_value_fn, n_playout=n_playout, is_selfplay=True)
+        for i in range(n_games):
+            game.start_self_play(player, temp=1.0)
+        calls = cache.get_metrics()["misses"]
+
+        symmetric_net = SymmetricPolicyValueNet(EvaluationCache(net), DihedralSymmetry(board.width, has_pass=(name == "Reversi")))
+        player = MCTSPlayer(symmetric_net.policy_value_fn, n_playout=n_playout, is_selfplay=True)
+        for i in range(n_games):
+            game.start_self_play(player, temp=1.0)
+        metrics = symmetric_net.get_metrics()
+        print("{}: {:.1f} nn calls per game with cache, {:.1f} with symmetry and cache, {}".format(
+            name, calls / n_games, metrics["nn_evaluations"] / n_games, metrics))
+
+
+def replay_buffer_sampling(buffer_size=10000, width=10, batch_size=512, n_batches=100):
+    """
+    比较原来的deque和ReplayBuffer保存同样的随机数据时占用的内存，以及取一批训练数据的时间。
+    :param buffer_size: 数据集保存的大小
+    :param width: 棋盘宽度
+    :param batch_size: 每批数据数量
+    :param n_batches: 取多少批
+    """
+    play_data = [((np.random.rand(4, width, width) < 0.3).astype(np.float64), np.random.dirichlet(np.ones(width * width)),
+                  random.choice([-1.0, 1.0])) for i in range(buffer_size)]
+    data_buffer = deque(play_data, maxlen=buffer_size)
+    deque_bytes = sum(state.nbytes + probs.nbytes for state, probs, winner in data_buffer)
+    start_time = time.time()
+    for i in range(n_batches):
+        mini_batch = random.sample(data_buffer, batch_size)
+        state_batch = [data[0] for data in mini_batch]
+        mcts_probs_batch = [data[1] for data in mini_batch]
+        winner_batch = [data[2] for data in mini_batch]
+        np.array(state_batch), np.array(mcts_probs_batch)  # 送进tensorflow前也要转成数组
+    print("deque: {:.1f} MB, {:.2f} ms per batch".format(deque_bytes / 1024 / 1024, (time.time() - start_time) * 1000 / n_batches))
+
+    replay_buffer = ReplayBuffer(buffer_size)
+    replay_buffer.extend(play_data)
+    start_time = time.time()
+    for i in range(n_batches):
+        replay_buffer.sample(batch_size)
+    print("ReplayBuffer: {:.1f} MB, {:.2f} ms per batch".format(replay_buffer.nbytes() / 1024 / 1024,
+                                                              (time.time() - start_time) * 1000 / n_batches))
+
+
+def lazy_augmentation(n_positions=2000, width=10, batch_size=512, n_batches=100):
+    """
+    比较保存所有8种对称变换（原来的做法）和每个棋局只保存一次、取数据时再随机变换时，同样多不同棋局占用的内存和每批的取数据时间。
+    :param n_positions: 不同棋局的数量
+    :param width: 棋盘宽度
+    :param batch_size: 每批数据数量
+    :param n_batches: 取多少批
+    """
+    symmetry = DihedralSymmetry(width)
+    play_data = [((np.random.rand(4, width, width) < 0.3).astype(np.float64), np.random.dirichlet(np.ones(width * width)),
+                  random.choice([-1.0, 1.0])) for i in range(n_positions)]
+    for name, data, sample_symmetry in [("eager", symmetry.augment(play_data), None), ("lazy", play_data, symmetry)]:
+        replay_buffer = ReplayBuffer(len(data))
+        replay_buffer.extend(data)
+        start_time = time.time()
+        for i in range(n_batches):
+            replay_buffer.sample(batch_size, symmetry=sample_symmetry)
+        print("{}: {} records, {:.1f} MB, {:.2f} ms per batch".format(name, len(replay_buffer), replay_buffer.nbytes() / 1024 / 1024,
+                                                                      (time.time() - start_time) * 1000 / n_batches))
+
+
+def compare_boards(create_board, create_reference_board, n_games=1000, max_moves=200):
+    """
+    两个棋盘走同样的随机动作，比较它们的速度。结果是否完全相同由tests/test_boards.py检查。
+    :param create_board: 创建要比较的棋盘的函数
+    :param create_reference_board: 创建作为标准的棋盘的函数
+    :param n_games: 随机对局数
+    :param max_moves: 每局最多走多少步，四子棋可以一直弹出棋子不结束
+    """
+    seed = random.randrange(1 << 30)
+    for create in (create_reference_board, create_board):  # 各自用同样的随机动作测速度
+        rng = random.Random(seed)
+        start_time = time.time()
+        for i in range(n_games):
+            board = create()
+            board.init_board(i % 2)
+            for j in range(max_moves):
+                if board.game_end()[0]:
+                    break
+                board.do_move(rng.choice(board.get_available_moves()))
+        print("{}: {:.3f}s".format(type(board).__name__, time.time() - start_time))
+
+
+def inference_server_throughput(n_threads=16, n_playout=400, n_moves=5, max_batch_size=16):
+    """
+    每个游戏开n_threads个线程同时搜索，它们的叶子节点都交给同一个InferenceServer合并评估，打印每秒搜索次数和服务的统计数据。
+    :param n_threads: 同时搜索的线程数
+    :param n_playout: 每步的蒙特卡洛搜索次数
+    :param n_moves: 每个线程走多少步
+    :param max_batch_size: 每批最多多少个棋局
+    """
+    for name, board, net in create_games():
+        server = InferenceServer(net.policy_value, max_batch_size=max_batch_size).start()
+
+        def play(board):
+            player = MCTSPlayer(server.policy_value_fn, n_playout=n_playout)
+            board.init_board()
+            for i in range(n_moves):
+                if board.game_end()[0]:
+                    break
+                board.do_move(player.get_action(board))
+
+        threads = [threading.Thread(target=play, args=(copy.deepcopy(board),)) for i in range(n_threads)]
+        start_time = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start_time
+        server.stop()
+        print("{} threads={}: {:.1f} playouts/s, {}".format(name, n_threads, n_threads * n_moves * n_playout / elapsed,
+                                                           server.get_metrics()))
+
+
+def numpy_inference(batch_sizes=(1, 2, 4, 8, 16, 32, 64, 128, 256), n_repeat=20):
+    """
+    比较NumpyPolicyValueNet和tensorflow的输出差别，以及不同批大小下每次policy_value的延迟。
+    :param batch_sizes: 测试的批大小
+    :param n_repeat: 每个批大小重复多少次取平均
+    """
+    games = create_games()
+    with tf.Graph().as_default():
+        games.append(("Gobang2", GobangBoard(width=10, n_in_row=5), GobangPolicyValueNet2(10)))
+    for name, board, net in games:
+        numpy_net = NumpyPolicyValueNet(net.get_checkpoint_values(), net.board_width, getattr(net, "board_height", None))
+        states = (np.random.rand(*((max(batch_sizes),) + numpy_net.state_buffer.shape[1:])) < 0.3).astype(np.float32)
+        act_probs, value = net.policy_value(states)
+        numpy_act_probs, numpy_value = numpy_net.policy_value(states)
+        print("{}: max |p - p_tf| = {:.2e}, max |v - v_tf| = {:.2e}".format(
+            name, np.max(np.abs(numpy_act_probs - act_probs)), np.max(np.abs(numpy_value - value))))
+        for batch_size in batch_sizes:
+            latencies = []
+            for policy_value in (net.policy_value, numpy_net.policy_value):
+                policy_value(states[:batch_size])  # 预热
+                start_time = time.time()
+                for i in range(n_repeat):
+                    policy_value(states[:batch_size])
+                latencies.append((time.time() - start_time) / n_repeat * 1000)
+            print("{} batch_size={}: tensorflow {:.3f} ms, numpy {:.3f} ms".format(name, batch_size, *latencies))
+
+
+def policy_value_cost(net, states, n_repeat=20):
+    """
+    测量一次policy_value的延迟和计算时临时分配的内存峰值。
+    :param net: NumpyPolicyValueNet或QuantizedPolicyValueNet
+    :param states: 一批局面
+    :param n_repeat: 重复多少次取平均
+    :return: (毫秒, 字节)
+    """
+    net.policy_value(states)  # 预热
+    start_time = time.time()
+    for i in range(n_repeat):
+        net.policy_value(states)
+    latency = (time.time() - start_time) / n_repeat * 1000
+    tracemalloc.start()
+    net.policy_value(states)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return latency, peak
+
+
+def quantization(n_positions=1000, n_games=20, n_playout=200, batch_sizes=(1, 64)):
+    """
+    比较int8量化（以及再加上float16中间结果，或者中间结果也量化成int8）的神经网络和原来的神经网络：
+    常驻内存（参数和缓冲区），不同批大小下policy_value的延迟和临时内存峰值，随机局面上的动作P值KL散度和V值均方误差，
+    以及用同样的蒙特卡洛搜索对局的胜率（轮流先走，平局算半局）。
+    :param n_positions: 比较输出用的随机局面数量
+    :param n_games: 每种量化方式和原来的神经网络对局的局数
+    :param n_playout: 对局时每步的蒙特卡洛搜索次数
+    :param batch_sizes: 测量延迟和内存的批大小
+    """
+    variants = (("int8", {}), ("int8 + float16 activations", {"float16_activations": True}),
+                ("int8 + int8 activations", {"int8_activations": True}))
+    for name, board, net in create_games():
+        weights = net.get_checkpoint_values()
+        height = getattr(net, "board_height", None)
+        float_net = NumpyPolicyValueNet(weights, net.board_width, height)
+        states = []
+        while len(states) < n_positions:  # 随机走棋得到的局面
+            board.init_board(random.randint(0, 1))
+            while not board.game_end()[0] and len(states) < n_positions:
+                states.append(board.current_state().copy())
+                board.do_move(random.choice(list(board.get_available_moves())))
+        states = np.array(states, dtype=np.float32)
+        game = Game(board)
+        for label, test_net in [("float32", float_net)] + [
+                (label, QuantizedPolicyValueNet(weights, net.board_width, height, **options)) for label, options in variants]:
+            costs = ", ".join("batch_size={}: {:.3f} ms, peak {} bytes".format(
+                batch_size, *policy_value_cost(test_net, states[:batch_size])) for batch_size in batch_sizes)
+            print("{} {}: resident {} bytes, {}".format(name, label, test_net.nbytes(), costs))
+            if test_net is float_net:
+                continue
+            win, tie = 0, 0
+            for i in range(n_games):
+                quantized_player = MCTSPlayer(test_net.policy_value_fn, n_playout=n_playout)
+                float_player = MCTSPlayer(float_net.policy_value_fn, n_playout=n_playout)
+                winner = game.start_play(quantized_player, float_player, start_player=i % 2, is_shown=False, temp=1)
+                if winner == -1:
+                    tie += 1
+                elif winner == quantized_player.player:
+                    win += 1
+            print("{} {}: {}, win ratio vs float32 = {:.2f}".format(
+                name, label, compare_policy_value(test_net, float_net, states), (win + tie / 2) / n_games))
+
+
+def session_latency_worker(threads, lean, n_calls, ready_queue, start_event, result_queue):
+    """
+    session_threads_throughput的一个进程：创建五子棋的神经网络，连续调用n_calls次单个棋局的policy_value。
+    :param threads: (intra_op, inter_op)线程数
+    :param lean: 是否用只有前向计算的InferencePolicyValueNet
+    :param n_calls: 调用次数
+    :param ready_queue: 准备好后放入None
+    :param start_event: 所有进程都准备好后一起开始
+    :param result_queue: 放入这个进程用的秒数
+    """
+    set_session_threads(*threads)
+    net = GobangPolicyValueNet(10)
+    if lean:
+        net = InferencePolicyValueNet(freeze_graph_def(net), net.state_buffer.shape[1:])
+    state = np.zeros_like(net.state_buffer)
+    net.policy_value(state)  # 预热
+    ready_queue.put(None)
+    start_event.wait()
+    start_time = time.time()
+    for i in range(n_calls):
+        net.policy_value(state)
+    result_queue.put(time.time() - start_time)
+
+
+def session_threads_throughput(process_counts=(1, 4, 8), thread_configs=((0, 0), (1, 1), (2, 1)), n_calls=1000):
+    """
+    在同一台机器上同时跑多个进程，比较不同线程数设置和计算图下，单个棋局policy_value的平均延迟和所有进程加起来每秒的调用次数。
+    :param process_counts: 同时跑的进程数
+    :param thread_configs: (intra_op, inter_op)线程数，0表示由tensorflow决定
+    :param n_calls: 每个进程的调用次数
+    """
+    context = multiprocessing.get_context("spawn")
+    for n_processes in process_counts:
+        for threads in thread_configs:
+            for lean in (False, True):
+                ready_queue, start_event, result_queue = context.Queue(), context.Event(), context.Queue()
+                processes = [context.Process(target=session_latency_worker,
+                                             args=(threads, lean, n_calls, ready_queue, start_event, result_queue))
+                             for i in range(n_processes)]
+                for process in processes:
+                    process.start()
+                for process in processes:
+                    ready_queue.get()
+                start_event.set()
+                elapsed = [result_queue.get() for process in processes]
+                for process in processes:
+                    process.join()
+                print("processes={}, intra_op={}, inter_op={}, {} graph: {:.3f} ms/call, {:.0f} calls/s in total".format(
+                    n_processes, threads[0], threads[1], "inference" if lean else "training",
+                    np.mean(elapsed) / n_calls * 1000, n_processes * n_calls / max(elapsed)))
+
+
+if __name__ == "__main__":
+    compare_boards(lambda: GobangBitBoard(width=10, n_in_row=5), lambda: GobangBoard(width=10, n_in_row=5))
+    compare_boards(lambda: Connect4BitBoard(), lambda: Connect4Board())
+    compare_boards(lambda: ReversiBitBoard(width=8), lambda: ReversiBoard(width=8))
+    playouts_vs_batch_size()
+    lockstep_selfplay()
+    transposition_stats()
+    symmetry_savings()
+    replay_buffer_sampling()
+    lazy_augmentation()
+    numpy_inference()
+    quantization()
+    session_threads_throughput()
@@ -0,0 +1,144 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def position_key(board):
+    """
+    默认的缓存键：棋盘自己的get_evaluation_key()，例如五子棋是局面的哈希值和上一步落子位置，四子棋和翻转棋只有局面的哈希值。
+    :param board: 棋局
+    :return: 缓存键
+    """
+    return board.get_evaluation_key()
+
+
+class EvaluationCache:
+    """
+    放在PolicyValueNet前面的神经网络评估缓存，按最近最少使用的顺序淘汰，占用的内存不超过max_bytes。
+    policy_value_fn先用key_fn(board)查缓存，没有才调用神经网络。train_step，restore_model和set_weights会改变神经网络的参数，
+    所以调用它们时清空缓存。其他方法和属性直接转给原来的神经网络，所以可以代替原来的神经网络传给MCTSPlayer和Trainer。
+    policy_value(state_batch)只有棋局状态，没有哈希值，不经过缓存。
+    get，put和clear加了锁，可以在多个线程里用。每次清空缓存generation加一，put时传入评估开始时的generation，
+    评估期间神经网络参数变了的结果不会存进缓存。
+    """
+
+    entry_overhead = 200  # 每个缓存项除了动作P值数组以外大约占用的字节数
+
+    def __init__(self, policy_value_net, max_bytes=64 * 1024 * 1024, key_fn=position_key):
+        """
+        :param policy_value_net: 具体某个游戏的PolicyValueNet对象
+        :param max_bytes: 缓存最多占用的字节数
+        :param key_fn: 接受一个board并返回缓存键的函数
+        """
+        self.policy_value_net = policy_value_net
+        self.max_bytes = max_bytes
+        self.key_fn = key_fn
+        self._entries = OrderedDict()  # 键是缓存键，值是(所有动作的P值, V值)，最近用过的在最后
+        self._n_bytes = 0
+        self._n_hits = 0
+        self._n_misses = 0
+        self._n_evictions = 0
+        self._lock = threading.Lock()
+        self.generation = 0  # 清空缓存的次数，也就是神经网络参数的版本
+
+    def __getattr__(self, name):
+        if name == "policy_value_net":  # 还没有初始化时（例如复制对象时）不要无限递归
+            raise AttributeError(name)
+        return getattr(self.policy_value_net, name)
+
+    def get(self, key):
+        """
+        查缓存。
+        :param key: 缓存键
+        :return: (所有动作的P值, V值)，没有时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._n_misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._n_hits += 1
+            return entry
+
+    def put(self, key, act_probs, value, generation=None):
+        """
+        存进缓存，超过max_bytes时淘汰最久没有用过的缓存项。
+        :param key: 缓存键
+        :param act_probs: 所有动作的P值
+        :param value: V值
+        :param generation: 开始评估时的generation，和现在的不同时说明评估期间缓存被清空过，结果过期了不存。为None时不检查
+        """
+        act_probs = np.array(act_probs, dtype=np.float32)
+        with self._lock:
+            if key in self._entries or (generation is not None and generation != self.generation):
+                return
+            self._entries[key] = (act_probs, float(np.asarray(value).item()))
+            self._n_bytes += act_probs.nbytes + self.entry_overhead
+            while self._n_bytes > self.max_bytes and self._entries:
+                old_key, (old_probs, old_value) = self._entries.popitem(last=False)
+                self._n_bytes -= old_probs.nbytes + self.entry_overhead
+                self._n_evictions += 1
+
+    def clear(self):
+        """
+        清空缓存，计数器不清零，generation加一。
+        """
+        with self._lock:
+            self._entries.clear()
+            self._n_bytes = 0
+            self.generation += 1
+
+    def policy_value_fn(self, board):
+        """
+        论文里面的神经网络函数(p,v)=f(s)，先查缓存。
+        :param board: 棋局
+        :return: (action, probability)列表和v值
+        """
+        legal_moves = board.get_available_moves()
+        key = self.key_fn(board)
+        entry = self.get(key)
+        if entry is None:
+            generation = self.generation
+            board.current_state(out=self.policy_value_net.state_buffer[0])
+            act_probs, value = self.policy_value_net.policy_value(self.policy_value_net.state_buffer)
+            entry = act_probs[0], float(np.asarray(value).item())
+            self.put(key, *entry, generation=generation)
+        act_probs, value = entry
+        return zip(legal_moves, act_probs[legal_moves]), value
+
+    # 改变参数前后都清空一次，改变参数期间开始的评估用的可能是一半新一半旧的参数，结果也不能存进缓存
+    def train_step(self, state_batch, mcts_probs, winner_batch, lr, return_policy_value=False):
+        self.clear()
+        if return_policy_value:
+            result = self.policy_value_net.train_step(state_batch, mcts_probs, winner_batch, lr, return_policy_value=True)
+        else:
+            result = self.policy_value_net.train_step(state_batch, mcts_probs, winner_batch, lr)
+        self.clear()
+        return result
+
+    def restore_model(self, model_path):
+        self.clear()
+        self.policy_value_net.restore_model(model_path)
+        self.clear()
+
+    def set_weights(self, weights):
+        self.clear()
+        self.policy_value_net.set_weights(weights)
+        self.clear()
+
+    def get_metrics(self):
+        """
+        :return: 统计数据，包括命中，未命中和淘汰次数，命中率，缓存项数量和占用的字节数
+        """
+        with self._lock:
+            n_lookups = self._n_hits + self._n_misses
+            return {
+                "hits": self._n_hits,
+                "misses": self._n_misses,
+                "evictions": self._n_evictions,
+                "hit_rate": self._n_hits / n_lookups if n_lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._n_bytes,
+            }
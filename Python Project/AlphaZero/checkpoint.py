@@ -0,0 +1,181 @@
+import os
+import json
+import queue
+import threading
+
+import tensorflow as tf
+from model import output_node_names
+
+
+class CheckpointManager:
+    """
+    在后台线程里保存模型。save在调用的线程里只取出所有变量的值，写检查点，statistics.json和graph.bytes都在后台线程里做，
+    用的是从神经网络导出的计算图在另一个session里的副本，不会阻塞训练。
+    每个检查点保存在save_dir/batch_index目录里，和原来Trainer.run保存的一样，另外可以带上恢复训练用的trainer_state.json。
+    保留策略：最近keep_last个，batch_index是keep_every倍数的，以及评估分数最高的检查点保留，其他检查点的模型文件删掉，
+    statistics.json一直保留，画学习曲线不受影响。keep_last为0时全部保留。
+    """
+
+    def __init__(self, policy_value_net, save_dir, keep_last=0, keep_every=0, freeze=False,
+                 model_name="policy_value_net.model"):
+        """
+        :param policy_value_net: 具体某个游戏的PolicyValueNet对象
+        :param save_dir: 模型保存目录
+        :param keep_last: 保留最近多少个检查点，为0时全部保留
+        :param keep_every: 另外保留batch_index是它的倍数的检查点，为0时不按这个保留
+        :param freeze: 是否同时把计算图和参数合并成graph.bytes，可以直接给*PretrainedPolicyValueNet用
+        :param model_name: 检查点的文件名
+        """
+        self.policy_value_net = policy_value_net
+        self.save_dir = save_dir
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.freeze = freeze
+        self.model_name = model_name
+        self.saved = []  # 还有模型文件的检查点的batch_index，从小到大
+        self.evaluations = {}  # 键是batch_index，值是评估分数
+        self._meta_graph = None  # 神经网络计算图的MetaGraphDef，第一次保存时导出
+        self._queue = queue.Queue()
+        self._thread = None
+        self._error = None  # 后台线程里出的错，下次调用save或wait时抛出
+        self._scan()
+
+    def _scan(self):
+        """
+        找出save_dir里已经有的检查点，重新启动训练时它们也按保留策略处理。
+        """
+        if not os.path.isdir(self.save_dir):
+            return
+        for name in os.listdir(self.save_dir):
+            directory = os.path.join(self.save_dir, name)
+            if not name.isdigit() or not os.path.exists(os.path.join(directory, "checkpoint")):
+                continue
+            self.saved.append(int(name))
+            statistics_path = os.path.join(directory, "statistics.json")
+            if os.path.exists(statistics_path):
+                with open(statistics_path) as file:
+                    statistics = json.load(file)
+                if statistics.get("evaluation") is not None:
+                    self.evaluations[int(name)] = statistics["evaluation"]
+        self.saved.sort()
+
+    def save(self, batch_index, statistics, evaluation=None, trainer_state=None):
+        """
+        取出神经网络所有变量的值，交给后台线程保存。返回后神经网络就可以继续训练。
+        :param batch_index: 玩到第几批次游戏，检查点保存在save_dir/batch_index目录里
+        :param statistics: 写到statistics.json里的字典
+        :param evaluation: 这个模型的评估分数（例如和别的AI对局的胜率），分数最高的检查点一直保留，为None时不参与比较
+        :param trainer_state: 写到trainer_state.json里的字典，为None时不写
+        """
+        self._raise_error()
+        if self._meta_graph is None:
+            self._meta_graph = tf.train.export_meta_graph(graph=self.policy_value_net.session.graph,
+                                                          saver_def=self.policy_value_net.saver.as_saver_def(),
+                                                          clear_devices=True)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._write_loop, daemon=True)
+            self._thread.start()
+        statistics = dict(statistics)
+        if evaluation is not None:
+            statistics["evaluation"] = evaluation
+        self._queue.put((batch_index, self.policy_value_net.get_checkpoint_values(), statistics, trainer_state))
+
+    def wait(self):
+        """
+        等待已经提交的检查点都写完。
+        """
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """
+        写完已经提交的检查点后停止后台线程。
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        self._raise_error()
+
+    def best(self):
+        """
+        :return: 评估分数最高的检查点的batch_index，没有评估过时返回None
+        """
+        if not self.evaluations:
+            return None
+        return max(self.evaluations, key=self.evaluations.get)
+
+    def latest_checkpoint(self):
+        """
+        :return: 最近一个检查点的模型路径，可以传给restore_model，没有检查点时返回None
+        """
+        if not self.saved:
+            return None
+        return os.path.join(self.save_dir, str(self.saved[-1]), self.model_name)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _write_loop(self):
+        """
+        后台线程：在自己的计算图和session里载入变量的值，写检查点，statistics.json，graph.bytes和trainer_state.json，再按保留策略删除旧的检查点。
+        """
+        graph = tf.Graph()
+        with graph.as_default():
+            saver = tf.train.import_meta_graph(self._meta_graph, clear_devices=True)
+            variables = {v.op.name: v for v in graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)}
+        session = tf.Session(graph=graph, config=tf.ConfigProto(device_count={"GPU": 0}))  # 只用CPU，不占用训练用的GPU
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                break
+            batch_index, values, statistics, trainer_state = item
+            try:
+                for name, value in values.items():
+                    variables[name].load(value, session)
+                directory = os.path.join(self.save_dir, str(batch_index))
+                saver.save(session, os.path.join(directory, self.model_name))
+                with open(os.path.join(directory, "statistics.json"), "w") as file:
+                    json.dump(statistics, file)
+                if self.freeze:
+                    graph_def = tf.graph_util.convert_variables_to_constants(session, graph.as_graph_def(), output_node_names)
+                    tf.train.write_graph(graph_def, directory, "graph.bytes", as_text=False)
+                if trainer_state is not None:  # 最后写，有它的检查点一定是完整的
+                    with open(os.path.join(directory, "trainer_state.json"), "w") as file:
+                        json.dump(trainer_state, file)
+                if batch_index not in self.saved:
+                    self.saved.append(batch_index)
+                    self.saved.sort()
+                if statistics.get("evaluation") is not None:
+                    self.evaluations[batch_index] = statistics["evaluation"]
+                self._apply_retention()
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+        session.close()
+
+    def _should_keep(self, batch_index):
+        """
+        :param batch_index: 检查点的batch_index
+        :return: 按保留策略这个检查点是否保留
+        """
+        if self.keep_last <= 0 or batch_index in self.saved[-self.keep_last:]:
+            return True
+        if self.keep_every > 0 and batch_index % self.keep_every == 0:
+            return True
+        return batch_index == self.best()
+
+    def _apply_retention(self):
+        """
+        删除不保留的检查点的模型文件，statistics.json留下。
+        """
+        for batch_index in [b for b in self.saved if not self._should_keep(b)]:
+            directory = os.path.join(self.save_dir, str(batch_index))
+            for name in os.listdir(directory):
+                if name != "statistics.json":
+                    os.remove(os.path.join(directory, name))
+            self.saved.remove(batch_index)
@@ -1,6 +1,25 @@
+import copy
+import random
+
 import numpy as np
 
 
+_zobrist_keys = {}
+
+
+def zobrist_keys(count):
+    """
+    得到count个固定的64位随机整数，用来计算Zobrist哈希值。
+    同样的count在所有进程里得到的随机数都一样，所以不同棋盘对象，不同进程算出的哈希值可以直接比较。
+    :param count: 随机数数量
+    :return: 随机整数元组
+    """
+    if count not in _zobrist_keys:
+        rng = random.Random(count)
+        _zobrist_keys[count] = tuple(rng.getrandbits(64) for i in range(count))
+    return _zobrist_keys[count]
+
+
 class Board:
     """"
     棋盘以及对玩家动作的反应方法
@@ -12,9 +31,10 @@ class Board:
         """
         pass
 
-    def current_state(self):
+    def current_state(self, out=None):
         """
         返回以当前玩家的视角看到的棋盘状态，神经网络的输入。
+        :param out: 形状和返回值相同的数组，传入时棋盘状态直接写到这个数组里，不再分配新的数组
         :return: 当前玩家的视角看到的棋盘状态，输入到神经网络
         """
         pass
@@ -52,6 +72,45 @@ class Board:
         """
         pass
 
+    def init_hash(self, count):
+        """
+        初始化Zobrist哈希值，在init_board设置完当前玩家后调用。棋盘上每个位置为每个玩家分配一个随机数，
+        局面的哈希值是所有棋子对应的随机数的异或，第二个玩家走时再异或上zobrist_player。
+        初始局面上已有的棋子需要自己异或到zobrist_hash上，do_move和undo_move也要增量更新zobrist_hash。
+        :param count: 棋盘位置数量
+        """
+        keys = zobrist_keys(count * len(self.players) + 1)
+        self.zobrist = {player: keys[i * count:(i + 1) * count] for i, player in enumerate(self.players)}
+        self.zobrist_player = keys[-1]
+        self.zobrist_hash = self.zobrist_player if self.current_player == self.players[1] else 0
+
+    def get_hash(self):
+        """
+        :return: 当前局面（所有棋子和当前玩家）的Zobrist哈希值，不同走法到达的相同局面哈希值相同
+        """
+        return self.zobrist_hash
+
+    def get_evaluation_key(self):
+        """
+        神经网络评估缓存的键，要能区分所有current_state不同的局面。默认就是局面的哈希值，
+        current_state里还有哈希值不包括的信息时子类要加上。
+        :return: 缓存键
+        """
+        return self.get_hash()
+
+    def can_undo(self):
+        """
+        棋盘是否实现了undo_move。实现了的棋盘在蒙特卡洛搜索时直接走子再撤销，不用每次搜索都复制一份棋盘。
+        :return: 是否能撤销动作
+        """
+        return False
+
+    def undo_move(self):
+        """
+        撤销最近一次do_move执行的动作，棋盘恢复到执行这个动作之前的状态。
+        """
+        raise NotImplementedError
+
 
 class Game:
     """
@@ -115,10 +174,14 @@ class Game:
         """
         self.board.init_board()
         p1, p2 = self.board.players
-        states, mcts_probs, current_players = [], [], []
+        state_shape = self.board.current_state().shape
+        states = np.empty((self.board.get_action_count(),) + state_shape)  # 预分配的棋局状态，不够时翻倍
+        mcts_probs, current_players = [], []
         while True:
             move, move_probs = player.get_action(self.board, temp=temp, return_prob=True)
-            states.append(self.board.current_state())  # 保存棋局状态
+            if len(current_players) == len(states):
+                states = np.concatenate([states, np.empty(states.shape)])
+            self.board.current_state(out=states[len(current_players)])  # 保存棋局状态
             mcts_probs.append(move_probs)  # 保存pi值
             current_players.append(self.board.current_player)
 
@@ -127,14 +190,81 @@ class Game:
                 self.graphic(p1, p2)
             end, winner = self.board.game_end()
             if end:
-                winners_z = np.zeros(len(current_players))
-                if winner != -1:
-                    winners_z[np.array(current_players) == winner] = 1.0
-                    winners_z[np.array(current_players) != winner] = -1.0
                 player.reset_player()
                 if is_shown:
                     if winner != -1:
                         print("Game end. Winner is player:", winner)
                     else:
                         print("Game end. Tie")
-                return winner, zip(states, mcts_probs, winners_z)
+                return winner, zip(states[:len(current_players)], mcts_probs, self.winners_z(current_players, winner))
+
+    def start_self_play_batch(self, players, policy_value, temp=1e-3):
+        """
+        同时进行len(players)局自我对局。每一轮每局的蒙特卡洛搜索都往前走一步，所有局需要评估的叶子节点合并成一批，
+        一次调用policy_value，这样不用多进程也能让神经网络一次评估很多棋局。
+        :param players: MCTSPlayer列表，每局用一个
+        :param policy_value: 神经网络的policy_value方法，接受一批棋局状态并返回一批动作P值和局面V值
+        :param temp: 论文里面的温度值
+        :return: 生成器，每局结束时产生这局赢了的玩家编号和对局数据(state, mcts_probs, z)
+        """
+        games = []
+        for player in players:
+            board = copy.deepcopy(self.board)
+            board.init_board()
+            games.append({"board": board, "player": player, "states": [], "mcts_probs": [], "current_players": [],
+                          "steps": player.get_action_steps(board, temp=temp, return_prob=True), "request": None})
+
+        def advance(game, evaluation):
+            """
+            把评估结果交给这局的搜索，一直走到它需要新的评估，或者这局结束。
+            :return: 这局是否结束了
+            """
+            board, player = game["board"], game["player"]
+            while True:
+                try:
+                    game["request"] = game["steps"].send(evaluation)
+                    return False
+                except StopIteration as stop:  # 搜索完了，走一步
+                    move, move_probs = stop.value
+                    game["states"].append(board.current_state())
+                    game["mcts_probs"].append(move_probs)
+                    game["current_players"].append(board.current_player)
+                    board.do_move(move)
+                    end, winner = board.game_end()
+                    if end:
+                        player.reset_player()
+                        game["winner"] = winner
+                        return True
+                    game["steps"] = player.get_action_steps(board, temp=temp, return_prob=True)
+                    evaluation = None
+
+        finished = [game for game in games if advance(game, None)]
+        while True:
+            for game in finished:
+                games.remove(game)
+                yield game["winner"], zip(game["states"], game["mcts_probs"],
+                                          self.winners_z(game["current_players"], game["winner"]))
+            if not games:
+                return
+            sizes = [len(game["request"]) for game in games]
+            act_probs, values = policy_value(np.concatenate([game["request"] for game in games]))
+            finished = []
+            offset = 0
+            for game, size in zip(games, sizes):
+                if advance(game, (act_probs[offset:offset + size], values[offset:offset + size])):
+                    finished.append(game)
+                offset += size
+
+    @staticmethod
+    def winners_z(current_players, winner):
+        """
+        计算每一步的z值，走这一步的玩家最后赢了为1，输了为-1，平局为0。
+        :param current_players: 每一步的当前玩家编号
+        :param winner: 赢了的玩家编号，-1表示平局
+        :return: z值数组
+        """
+        winners_z = np.zeros(len(current_players))
+        if winner != -1:
+            winners_z[np.array(current_players) == winner] = 1.0
+            winners_z[np.array(current_players) != winner] = -1.0
+        return winners_z
@@ -0,0 +1,266 @@
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class InferenceServer:
+    """
+    神经网络推理服务。很多个线程里的蒙特卡洛搜索各自提交单个棋局，服务线程把它们合并成一批，一次调用神经网络的policy_value。
+    一批凑够max_batch_size个棋局，或者这一批的第一个棋局已经等了max_wait秒，就送进神经网络。
+    适用于五子棋，四子棋和翻转棋的所有PolicyValueNet。
+    别的进程用create_clients创建的InferenceClient提交棋局，由转发线程提交给服务，所以多个自我对局进程也可以共用一个服务。
+    """
+
+    def __init__(self, policy_value, max_batch_size=64, max_wait=0.002, latency_window=10000):
+        """
+        :param policy_value: 神经网络的policy_value方法，接受一批棋局状态并返回一批动作P值和局面V值
+        :param max_batch_size: 每批最多多少个棋局
+        :param max_wait: 每批最多等多少秒
+        :param latency_window: 统计延迟时保留最近多少个请求
+        """
+        self._policy_value = policy_value
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+        self._state_batch = None  # 预分配的一批棋局状态
+        self._stopped = False  # stop之后不再接受请求
+        self._submit_lock = threading.Lock()  # 保证stop之后不会再有请求放进队列
+        self._request_queue = None  # InferenceClient发来的请求，(客户端编号, 一批棋局状态)
+        self._response_queues = []  # 每个InferenceClient接收结果的队列
+        self._relay_thread = None
+
+        self._lock = threading.Lock()
+        self._batch_size_counts = {}  # 键是批大小，值是出现次数
+        self._latencies = deque(maxlen=latency_window)  # 最近请求从提交到得到结果的秒数
+        self._n_requests = 0
+        self._n_batches = 0
+
+    def start(self):
+        """
+        启动服务线程，创建过InferenceClient时同时启动转发线程。
+        """
+        self._stopped = False
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._serve, daemon=True)
+            self._thread.start()
+        if self._request_queue is not None and self._relay_thread is None:
+            self._relay_thread = threading.Thread(target=self._relay, daemon=True)
+            self._relay_thread.start()
+        return self
+
+    def stop(self):
+        """
+        处理完已经提交的请求后停止服务线程。之后再提交的请求会被拒绝，没有处理的请求的Future设置成异常。
+        """
+        with self._submit_lock:
+            self._stopped = True
+        if self._relay_thread is not None:
+            self._request_queue.put(None)
+            self._relay_thread.join()
+            self._relay_thread = None
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        while True:  # 没有启动过服务线程时提交的请求
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request[1].set_exception(Exception("InferenceServer已经停止"))
+
+    def submit(self, state):
+        """
+        提交一个棋局。
+        :param state: 一个棋局状态，board.current_state()的返回值
+        :return: Future对象，结果是这个棋局的(动作P值数组, V值)
+        """
+        future = Future()
+        with self._submit_lock:
+            if self._stopped:
+                raise Exception("InferenceServer已经停止")
+            self._queue.put((state, future, time.time()))
+        return future
+
+    def create_clients(self, n_clients, context=multiprocessing):
+        """
+        创建给别的进程用的InferenceClient，在start之前调用。
+        :param n_clients: 客户端数量，每个进程一个
+        :param context: multiprocessing或者multiprocessing.get_context的返回值，要和创建进程的一样
+        :return: InferenceClient列表，可以作为参数传给进程
+        """
+        self._request_queue = context.Queue()
+        self._response_queues = [context.Queue() for i in range(n_clients)]
+        return [InferenceClient(i, self._request_queue, response_queue) for i, response_queue in enumerate(self._response_queues)]
+
+    def policy_value(self, state_batch):
+        """
+        和神经网络的policy_value一样，每个棋局单独提交，可以和别的线程提交的棋局合并。
+        :param state_batch: 一堆棋局
+        :return: 一堆动作P值和局面V值
+        """
+        results = [future.result() for future in [self.submit(state) for state in state_batch]]
+        act_probs, values = zip(*results)
+        return np.array(act_probs), np.array(values)
+
+    def policy_value_fn(self, board):
+        """
+        论文里面的神经网络函数(p,v)=f(s)，可以直接传给MCTSPlayer。
+        :param board: 棋局
+        :return: (action, probability)列表和v值
+        """
+        legal_moves = list(board.get_available_moves())
+        act_probs, value = self.submit(board.current_state()).result()
+        return zip(legal_moves, act_probs[legal_moves]), value
+
+    def _relay(self):
+        """
+        转发线程：把InferenceClient发来的每个棋局单独提交，一批里的棋局都有结果后发回给那个客户端。
+        不等结果就接着转发下一个请求，这样不同进程的棋局可以合并成一批。
+        """
+        while True:
+            request = self._request_queue.get()
+            if request is None:
+                break
+            client_id, state_batch = request
+            try:
+                futures = [self.submit(state) for state in state_batch]
+            except Exception as e:
+                self._response_queues[client_id].put(e)
+                continue
+            self._reply_when_done(client_id, futures)
+
+    def _reply_when_done(self, client_id, futures):
+        """
+        所有Future都有结果后把(一堆动作P值, 一堆局面V值)发给客户端，出错时发异常。
+        :param client_id: 客户端编号
+        :param futures: 这个请求里每个棋局的Future对象
+        """
+        lock = threading.Lock()
+        remaining = [len(futures)]
+
+        def done(future):
+            with lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+            try:
+                act_probs, values = zip(*[f.result() for f in futures])
+                response = np.array(act_probs), np.array(values)
+            except Exception as e:
+                response = e
+            self._response_queues[client_id].put(response)
+
+        for future in futures:
+            future.add_done_callback(done)
+
+    def _serve(self):
+        """
+        服务线程：取出请求，凑成一批送进神经网络，再把结果分给每个请求。
+        """
+        running = True
+        while running:
+            request = self._queue.get()
+            if request is None:
+                break
+            requests = [request]
+            deadline = time.time() + self._max_wait
+            while len(requests) < self._max_batch_size:
+                try:
+                    request = self._queue.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if request is None:  # 处理完这一批就停止
+                    running = False
+                    break
+                requests.append(request)
+            self._run_batch(requests)
+
+    def _run_batch(self, requests):
+        """
+        把一批请求送进神经网络并设置每个请求的结果。
+        :param requests: (棋局状态, Future对象, 提交时间)列表
+        """
+        n = len(requests)
+        if self._state_batch is None:
+            self._state_batch = np.zeros((self._max_batch_size,) + np.shape(requests[0][0]), dtype=np.float32)
+        for i, (state, future, submit_time) in enumerate(requests):
+            self._state_batch[i] = state
+        try:
+            act_probs, values = self._policy_value(self._state_batch[:n])
+        except Exception as e:
+            for state, future, submit_time in requests:
+                future.set_exception(e)
+            return
+        finish_time = time.time()
+        for i, (state, future, submit_time) in enumerate(requests):
+            future.set_result((act_probs[i], values[i]))
+        with self._lock:
+            self._batch_size_counts[n] = self._batch_size_counts.get(n, 0) + 1
+            self._latencies.extend(finish_time - submit_time for state, future, submit_time in requests)
+            self._n_requests += n
+            self._n_batches += 1
+
+    def get_metrics(self):
+        """
+        :return: 统计数据，包括队列里等待的请求数，批大小直方图，平均批大小和最近请求的延迟（秒）
+        """
+        with self._lock:
+            latencies = np.array(self._latencies)
+            metrics = {
+                "queue_depth": self._queue.qsize(),
+                "requests": self._n_requests,
+                "batches": self._n_batches,
+                "mean_batch_size": self._n_requests / self._n_batches if self._n_batches else 0.0,
+                "batch_size_histogram": dict(sorted(self._batch_size_counts.items())),
+            }
+        if len(latencies):
+            metrics["latency_mean"] = float(np.mean(latencies))
+            metrics["latency_p50"] = float(np.percentile(latencies, 50))
+            metrics["latency_p99"] = float(np.percentile(latencies, 99))
+        return metrics
+
+
+class InferenceClient:
+    """
+    在别的进程里代替神经网络用的客户端，由InferenceServer.create_clients创建。
+    棋局通过进程间的队列发给训练进程里的InferenceServer，和别的进程的棋局合并成一批评估，每次等到结果才返回。
+    """
+
+    def __init__(self, client_id, request_queue, response_queue):
+        """
+        :param client_id: 客户端编号
+        :param request_queue: 所有客户端共用的请求队列
+        :param response_queue: 这个客户端接收结果的队列
+        """
+        self.client_id = client_id
+        self.request_queue = request_queue
+        self.response_queue = response_queue
+
+    def policy_value(self, state_batch):
+        """
+        :param state_batch: 一堆棋局
+        :return: 一堆动作P值和局面V值
+        """
+        self.request_queue.put((self.client_id, np.asarray(state_batch, dtype=np.float32)))
+        response = self.response_queue.get()
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def policy_value_fn(self, board):
+        """
+        论文里面的神经网络函数(p,v)=f(s)，可以直接传给MCTSPlayer。
+        :param board: 棋局
+        :return: (action, probability)列表和v值
+        """
+        legal_moves = list(board.get_available_moves())
+        act_probs, values = self.policy_value(board.current_state()[np.newaxis])
+        return zip(legal_moves, act_probs[0][legal_moves]), values[0]
@@ -17,6 +17,7 @@ class TreeNode:
         self._parent = parent
         self._children = {}  # 键是动作值，值是节点
         self._n_visits = 0
+        self._n_virtual = 0  # 虚拟损失，批量搜索时还没有评估完的路径上的节点暂时被当作输了这么多次
         self._Q = 0
         self._P = prior_p
 
@@ -35,7 +36,7 @@ class TreeNode:
         :param c_puct: 一个在范围(0, inf)的值，控制Q和P的比例
         :return: 二元组(action, next_node)
         """
-        return max(self._children.items(), key=lambda act_node: act_node[1].get_value(c_puct))
+        return max(self._children.items(), key=lambda act_node: act_node[1].get_value(c_puct, self))
 
     def update(self, leaf_value):
         """
@@ -54,14 +55,22 @@ class TreeNode:
             self._parent.update_recursive(-leaf_value)
         self.update(leaf_value)
 
-    def get_value(self, c_puct):
+    def get_value(self, c_puct, parent=None):
         """
         得到该节点的Q+u(P)值
         :param c_puct: 一个在范围(0, inf)的值，控制Q和P的比例
+        :param parent: 选择这个节点的父节点，为None时用_parent。子节点被多个父节点共用时需要传入
         :return: 该节点的Q+u(P)值
         """
-        u = c_puct * self._P * np.sqrt(self._parent._n_visits) / (1 + self._n_visits)
-        return self._Q + u
+        if parent is None:
+            parent = self._parent
+        if parent._n_virtual == 0:
+            u = c_puct * self._P * np.sqrt(parent._n_visits) / (1 + self._n_visits)
+            return self._Q + u
+        n_visits = self._n_visits + self._n_virtual
+        u = c_puct * self._P * np.sqrt(parent._n_visits + parent._n_virtual) / (1 + n_visits)
+        q = (self._Q * self._n_visits - self._n_virtual) / n_visits if n_visits > 0 else 0
+        return q + u
 
     def is_leaf(self):
         """
@@ -83,26 +92,38 @@ class MCTS:
     蒙特卡洛树及其搜索方法。
     """
 
-    def __init__(self, policy_value_fn, c_puct=5, n_playout=300):
+    def __init__(self, policy_value_fn, c_puct=5, n_playout=300, policy_value_batch_fn=None, batch_size=1, virtual_loss=1):
         """
         :param policy_value_fn: 论文里面的(p,v)=f(s)函数。接受一个board作为参数并返回一个（动作，概率）列表和在[-1, 1]范围的局面胜率的函数
         :param c_puct: 论文里面的c_puct。一个在范围(0, inf)的数字，控制探索等级。值越小越依赖于Q值，值越大越依赖于P值
         :param n_playout: 找MCTS叶子节点次数，即每次搜索次数
+        :param policy_value_batch_fn: 神经网络的policy_value方法，接受一批棋局状态并返回一批动作P值和局面V值，batch_size大于1时使用
+        :param batch_size: 每次一起送进神经网络评估的叶子节点数量，大于1时用虚拟损失一次找多个不同的叶子节点。search一次也最多yield这么多个叶子节点
+        :param virtual_loss: 虚拟损失值，路径上的每个节点在评估完之前暂时被当作输了这么多次
         """
         self._root = TreeNode(None, 1.0)
         self._policy = policy_value_fn
         self._c_puct = c_puct
         self._n_playout = n_playout
+        self._policy_batch = policy_value_batch_fn
+        self._batch_size = batch_size
+        self._virtual_loss = virtual_loss
+        self._state_batch = None  # 预分配的一批叶子节点的棋局状态
+        if batch_size > 1 and policy_value_batch_fn is None:
+            raise Exception('batch_size大于1时需要提供policy_value_batch_fn')
 
     def _playout(self, state):
         """
         执行一次蒙特卡洛搜索，找到一个叶子节点，并更新路径上所有节点的值。
-        :param state: 一个Board对象，在搜索过程中这个Board对象的状态会随之改变，所以这个参数传进来前需要复制一份。
+        :param state: 一个Board对象，在搜索过程中这个Board对象的状态会随之改变，所以这个参数传进来前需要复制一份，或者在搜索后撤销执行过的动作。
+        :return: 这次搜索在state上执行的动作数量
         """
         node = self._root
+        depth = 0
         while not node.is_leaf():  # 找到一个叶子节点
             action, node = node.select(self._c_puct)
             state.do_move(action)
+            depth += 1
 
         action_probs, leaf_value = self._policy(state)  # 得到一个相对于当前玩家的(action, probability)列表和在范围[-1, 1]的V值
 
@@ -117,6 +138,7 @@ class MCTS:
 
         # 更新路径上所有节点的值
         node.update_recursive(-leaf_value)
+        return depth
 
     def get_move_probs(self, state, temp=1e-3):
         """
@@ -125,17 +147,163 @@ class MCTS:
         :param temp: 在范围(0, 1]的温度值
         :return: 所有动作值和所有动作相应的所有概率pi值
         """
+        if self._batch_size > 1:
+            steps = self.search(state, temp)
+            try:
+                state_batch = next(steps)
+                while True:
+                    state_batch = steps.send(self._policy_batch(state_batch))
+            except StopIteration as stop:
+                return stop.value
+
         for n in range(self._n_playout):
-            state_copy = copy.deepcopy(state)
-            self._playout(state_copy)
+            if state.can_undo():  # 直接在棋盘上搜索，搜索完再撤销
+                for i in range(self._playout(state)):
+                    state.undo_move()
+            else:
+                state_copy = copy.deepcopy(state)
+                self._playout(state_copy)
 
-        # 计算每个动作的概率pi值
-        act_visits = [(act, node._n_visits) for act, node in self._root._children.items()]
-        acts, visits = zip(*act_visits)
+        return self._move_probs(temp)
+
+    def search(self, state, temp=1e-3):
+        """
+        get_move_probs的生成器版本，由调用者负责神经网络评估，这样可以把很多棋局的叶子节点合并成一批评估。
+        每次需要评估时yield一批叶子节点的棋局状态，调用者用send把policy_value的结果(一批动作P值, 一批V值)送回来。
+        :param state: 一个Board类的对象，描述了当前棋局，搜索结束后状态不变
+        :param temp: 在范围(0, 1]的温度值
+        :return: 所有动作值和所有动作相应的所有概率pi值
+        """
+        n = 0
+        while n < self._n_playout:
+            paths, legal_moves, n_ended = self._select_leaves(state, min(self._batch_size, self._n_playout - n))
+            if paths:
+                act_probs, values = yield self._state_batch[:len(paths)]
+                self._expand_and_backup(paths, legal_moves, act_probs, values)
+            n += n_ended + len(paths)
+        return self._move_probs(temp)
+
+    def _move_probs(self, temp):
+        """
+        根据根节点所有子节点的N值计算每个动作的概率pi值。
+        :param temp: 在范围(0, 1]的温度值
+        :return: 所有动作值和所有动作相应的所有概率pi值
+        """
+        acts, visits = self._root_visits()
         act_probs = softmax(1.0/temp * np.log(np.array(visits) + 1e-10))
 
         return acts, act_probs
 
+    def _root_visits(self):
+        """
+        :return: 根节点所有子节点的动作值和N值
+        """
+        act_visits = [(act, node._n_visits) for act, node in self._root._children.items()]
+        return zip(*act_visits)
+
+    def _select_leaves(self, state, n_leaves):
+        """
+        用虚拟损失找到最多n_leaves个不同的叶子节点，它们的棋局状态写到预分配的数组里等待评估。
+        游戏已经结束的叶子节点，以及_backup_cached能处理的叶子节点直接更新。
+        :param state: 一个Board对象，搜索结束后状态不变
+        :param n_leaves: 最多找多少个叶子节点
+        :return: 等待评估的路径列表，这些叶子节点能走的动作列表，以及已经直接更新了的叶子节点数量
+        """
+        can_undo = state.can_undo()
+        if self._state_batch is None:
+            self._state_batch = np.zeros((self._batch_size,) + state.current_state().shape, dtype=np.float32)
+        paths, legal_moves = [], []
+        n_ended = 0
+        for i in range(n_leaves):
+            board = state if can_undo else copy.deepcopy(state)
+            path = self._select_leaf(board)
+            leaf = path[-1]
+            end, winner = board.game_end()
+            collided = False
+            if end:  # 游戏已经结束的叶子节点不需要神经网络评估，直接更新路径上所有节点的值
+                if winner == -1:
+                    leaf_value = 0.0
+                else:
+                    leaf_value = (1.0 if winner == board.get_current_player() else -1.0)
+                self._backup_path(path, -leaf_value)
+                n_ended += 1
+            elif any(leaf == p[-1] for p in paths):  # 虚拟损失没能避开已经找到的叶子节点，先评估已经找到的这些
+                collided = True
+            elif self._backup_cached(path, board):
+                n_ended += 1
+            else:
+                self._add_virtual_loss(path, self._virtual_loss)
+                board.current_state(out=self._state_batch[len(paths)])
+                paths.append(path)
+                legal_moves.append(list(board.get_available_moves()))
+            if can_undo:
+                for j in range(len(path) - 1):
+                    board.undo_move()
+            if collided:
+                break
+        return paths, legal_moves, n_ended
+
+    def _expand_and_backup(self, paths, legal_moves, act_probs, values):
+        """
+        用神经网络的评估结果展开这些叶子节点，去掉虚拟损失并更新路径上所有节点的值。
+        :param paths: _select_leaves返回的路径列表
+        :param legal_moves: _select_leaves返回的能走的动作列表
+        :param act_probs: 一批动作P值
+        :param values: 一批V值
+        """
+        for path, probs, legal, value in zip(paths, act_probs, legal_moves, values):
+            self._add_virtual_loss(path, -self._virtual_loss)
+            self._expand_leaf(path[-1], zip(legal, probs[legal]))
+            self._backup_path(path, -np.asarray(value).item())
+
+    def _backup_cached(self, path, state):
+        """
+        不用神经网络评估，直接更新这条路径。MCTS总是需要评估，返回False。
+        :param path: 从根节点到叶子节点的路径
+        :param state: 一个Board对象，处于叶子节点的局面
+        :return: 是否已经更新了这条路径
+        """
+        return False
+
+    def _select_leaf(self, state):
+        """
+        从根节点开始一直选择Q+u(P)最大的子节点，直到叶子节点。
+        :param state: 一个Board对象，路径上的动作会在它上面执行
+        :return: 从根节点到叶子节点的路径
+        """
+        node = self._root
+        path = [node]
+        while not node.is_leaf():
+            action, node = node.select(self._c_puct)
+            state.do_move(action)
+            path.append(node)
+        return path
+
+    def _add_virtual_loss(self, path, virtual_loss):
+        """
+        给路径上所有节点加上虚拟损失，virtual_loss为负数时表示去掉虚拟损失。
+        :param path: 从根节点到叶子节点的路径
+        :param virtual_loss: 虚拟损失值
+        """
+        for node in path:
+            node._n_virtual += virtual_loss
+
+    def _expand_leaf(self, leaf, action_probs):
+        """
+        展开路径最后的叶子节点。
+        :param leaf: 叶子节点
+        :param action_probs: 一个元素为(action, P)的列表
+        """
+        leaf.expand(action_probs)
+
+    def _backup_path(self, path, leaf_value):
+        """
+        更新路径上所有节点的值。
+        :param path: 从根节点到叶子节点的路径
+        :param leaf_value: 从叶子节点的父节点玩家视角的评估值
+        """
+        path[-1].update_recursive(leaf_value)
+
     def update_with_move(self, last_move):
         """
         根据行动值更新树，继续使用子树。
@@ -149,3 +317,363 @@ class MCTS:
 
     def __str__(self):
         return "MCTS"
+
+
+class ArrayMCTS(MCTS):
+    """
+    用预分配的numpy数组存储整棵树的蒙特卡洛树及其搜索方法，可以代替MCTS使用。
+    每个节点占数组的一行，存了N值，Q值，P值和子节点的位置。一个节点的所有子节点在数组里连续存放，
+    选择子节点时对这一段做一次向量化的argmax，不再为每个节点创建一个TreeNode对象。
+    """
+
+    def __init__(self, policy_value_fn, c_puct=5, n_playout=300, policy_value_batch_fn=None, batch_size=1, virtual_loss=1,
+                 capacity=4096):
+        """
+        :param policy_value_fn: 论文里面的(p,v)=f(s)函数。接受一个board作为参数并返回一个（动作，概率）列表和在[-1, 1]范围的局面胜率的函数
+        :param c_puct: 论文里面的c_puct。一个在范围(0, inf)的数字，控制探索等级。值越小越依赖于Q值，值越大越依赖于P值
+        :param n_playout: 找MCTS叶子节点次数，即每次搜索次数
+        :param policy_value_batch_fn: 神经网络的policy_value方法，接受一批棋局状态并返回一批动作P值和局面V值，batch_size大于1时使用
+        :param batch_size: 每次一起送进神经网络评估的叶子节点数量，大于1时用虚拟损失一次找多个不同的叶子节点。search一次也最多yield这么多个叶子节点
+        :param virtual_loss: 虚拟损失值，路径上的每个节点在评估完之前暂时被当作输了这么多次
+        :param capacity: 初始预分配的节点数量，不够时自动翻倍
+        """
+        MCTS.__init__(self, policy_value_fn, c_puct, n_playout, policy_value_batch_fn, batch_size, virtual_loss)
+        self._allocate(capacity)
+        self._reset()
+
+    def _allocate(self, capacity):
+        """
+        分配能存capacity个节点的数组，已有的节点会被复制过去。
+        :param capacity: 节点数量
+        """
+        names = ("_action", "_n", "_n_virtual", "_q", "_p", "_first_child", "_n_children")
+        old_arrays = [getattr(self, name, None) for name in names]
+        self._action = np.zeros(capacity, dtype=np.int64)  # 从父节点到这个节点的动作值
+        self._n = np.zeros(capacity)  # N值
+        self._n_virtual = np.zeros(capacity)  # 虚拟损失
+        self._q = np.zeros(capacity)  # Q值
+        self._p = np.zeros(capacity)  # P值
+        self._first_child = np.full(capacity, -1, dtype=np.int64)  # 第一个子节点的行号
+        self._n_children = np.zeros(capacity, dtype=np.int64)  # 子节点数量，为0表示叶子节点
+        if old_arrays[0] is not None:
+            for name, old in zip(names, old_arrays):
+                getattr(self, name)[:self._size] = old[:self._size]
+        self._capacity = capacity
+
+    def _reset(self):
+        """
+        清空整棵树，只留下一个根节点。
+        """
+        self._root = 0
+        self._size = 1
+        self._action[0] = -1
+        self._n[0] = 0
+        self._n_virtual[0] = 0
+        self._q[0] = 0
+        self._p[0] = 1.0
+        self._first_child[0] = -1
+        self._n_children[0] = 0
+
+    def _expand(self, node, action_probs):
+        """
+        展开一个叶子节点，新的子节点放在数组末尾连续的行里。
+        :param node: 叶子节点的行号
+        :param action_probs: 一个元素为(action, P)的列表
+        """
+        action_probs = list(action_probs)
+        count = len(action_probs)
+        if count == 0:
+            return
+        if self._size + count > self._capacity:
+            self._allocate(max(self._capacity * 2, self._size + count))
+        start, end = self._size, self._size + count
+        acts, probs = zip(*action_probs)
+        self._action[start:end] = acts
+        self._p[start:end] = probs
+        self._n[start:end] = 0
+        self._n_virtual[start:end] = 0
+        self._q[start:end] = 0
+        self._first_child[start:end] = -1
+        self._n_children[start:end] = 0
+        self._first_child[node] = start
+        self._n_children[node] = count
+        self._size = end
+
+    def _select(self, node):
+        """
+        选择节点node所有子节点中Q+u(P)最大的返回。
+        :param node: 节点的行号
+        :return: 子节点的行号
+        """
+        start = self._first_child[node]
+        end = start + self._n_children[node]
+        if self._n_virtual[node] == 0:
+            u = self._c_puct * self._p[start:end] * np.sqrt(self._n[node]) / (1 + self._n[start:end])
+            return start + int(np.argmax(self._q[start:end] + u))
+        n_visits = self._n[start:end] + self._n_virtual[start:end]
+        u = self._c_puct * self._p[start:end] * np.sqrt(self._n[node] + self._n_virtual[node]) / (1 + n_visits)
+        q = (self._q[start:end] * self._n[start:end] - self._n_virtual[start:end]) / np.maximum(n_visits, 1)
+        return start + int(np.argmax(q + u))
+
+    def _backup(self, path, leaf_value):
+        """
+        根据叶子节点的V值一次更新路径上所有节点的N值和Q值。
+        :param path: 从根节点到叶子节点的行号列表
+        :param leaf_value: 从叶子节点的父节点玩家视角的评估值
+        """
+        path = np.array(path)
+        values = np.empty(len(path))
+        values[::-1][0::2] = leaf_value  # 叶子节点，以及和它相隔偶数层的节点
+        values[::-1][1::2] = -leaf_value
+        self._n[path] += 1
+        self._q[path] += (values - self._q[path]) / self._n[path]
+
+    def _playout(self, state):
+        """
+        执行一次蒙特卡洛搜索，找到一个叶子节点，并更新路径上所有节点的值。
+        :param state: 一个Board对象，在搜索过程中这个Board对象的状态会随之改变，所以这个参数传进来前需要复制一份，或者在搜索后撤销执行过的动作。
+        :return: 这次搜索在state上执行的动作数量
+        """
+        node = self._root
+        path = [node]
+        while self._n_children[node] > 0:  # 找到一个叶子节点
+            node = self._select(node)
+            path.append(node)
+            state.do_move(int(self._action[node]))
+
+        action_probs, leaf_value = self._policy(state)  # 得到一个相对于当前玩家的(action, probability)列表和在范围[-1, 1]的V值
+        leaf_value = np.asarray(leaf_value).item()
+
+        end, winner = state.game_end()  # 检查游戏是否结束
+        if not end:
+            self._expand(node, action_probs)
+        else:
+            if winner == -1:  # 平局V值为0
+                leaf_value = 0.0
+            else:
+                leaf_value = (1.0 if winner == state.get_current_player() else -1.0)  # 当前玩家赢了V值为1，输了V值为-1
+
+        # 更新路径上所有节点的值
+        self._backup(path, -leaf_value)
+        return len(path) - 1
+
+    def _root_visits(self):
+        """
+        :return: 根节点所有子节点的动作值和N值
+        """
+        start = self._first_child[self._root]
+        end = start + self._n_children[self._root]
+        return tuple(self._action[start:end].tolist()), self._n[start:end]
+
+    def _select_leaf(self, state):
+        """
+        从根节点开始一直选择Q+u(P)最大的子节点，直到叶子节点。
+        :param state: 一个Board对象，路径上的动作会在它上面执行
+        :return: 从根节点到叶子节点的行号列表
+        """
+        node = self._root
+        path = [node]
+        while self._n_children[node] > 0:
+            node = self._select(node)
+            state.do_move(int(self._action[node]))
+            path.append(node)
+        return path
+
+    def _add_virtual_loss(self, path, virtual_loss):
+        self._n_virtual[path] += virtual_loss
+
+    def _expand_leaf(self, leaf, action_probs):
+        self._expand(leaf, action_probs)
+
+    def _backup_path(self, path, leaf_value):
+        self._backup(path, leaf_value)
+
+    def update_with_move(self, last_move):
+        """
+        根据行动值更新树，继续使用子树。子树会被挪到数组的最前面，其余节点占的行被回收。
+        :param last_move: 上一次行动值
+        """
+        start = self._first_child[self._root]
+        end = start + self._n_children[self._root]
+        children = np.nonzero(self._action[start:end] == last_move)[0]
+        if self._n_children[self._root] > 0 and len(children) > 0:
+            self._compact(start + int(children[0]))
+        else:
+            self._reset()
+
+    def _compact(self, new_root):
+        """
+        按广度优先的顺序把以new_root为根的子树复制到数组的最前面，new_root成为新的根节点。
+        :param new_root: 新的根节点的行号
+        """
+        old_rows = [new_root]  # 第i个元素是新的第i行对应的旧行号
+        first_child = []
+        i = 0
+        while i < len(old_rows):
+            old = old_rows[i]
+            count = int(self._n_children[old])
+            if count > 0:
+                first_child.append(len(old_rows))
+                start = int(self._first_child[old])
+                old_rows.extend(range(start, start + count))
+            else:
+                first_child.append(-1)
+            i += 1
+        old_rows = np.array(old_rows)
+        size = len(old_rows)
+        for array in (self._action, self._n, self._n_virtual, self._q, self._p, self._n_children):
+            array[:size] = array[old_rows]
+        self._first_child[:size] = first_child
+        self._root = 0
+        self._size = size
+
+    def __str__(self):
+        return "ArrayMCTS"
+
+
+class TranspositionMCTS(MCTS):
+    """
+    识别不同走法到达的相同局面的蒙特卡洛树，可以代替MCTS使用，棋盘需要实现get_hash()。
+    每个局面第一次被神经网络评估并展开后，节点和V值存进以局面哈希值为键的置换表。以后在别的路径上遇到相同局面的叶子节点时，
+    这个叶子节点直接共用那个节点的子节点（所以也共用子节点的N值和Q值），用缓存的V值更新路径，不再调用神经网络。
+    因为子节点可能有多个父节点，更新时沿着路径进行，不使用节点的_parent。
+    """
+
+    def __init__(self, policy_value_fn, c_puct=5, n_playout=300, policy_value_batch_fn=None, batch_size=1, virtual_loss=1):
+        """
+        参数和MCTS相同。
+        """
+        MCTS.__init__(self, policy_value_fn, c_puct, n_playout, policy_value_batch_fn, batch_size, virtual_loss)
+        self._table = {}  # 置换表，键是局面的哈希值，值是(已经展开的节点, 神经网络评估的V值)
+        self._leaf_hashes = {}  # 等待评估的叶子节点的局面哈希值
+        self._n_lookups = 0  # 这一步查置换表的次数
+        self._n_hits = 0  # 这一步在置换表里找到的次数，也就是省下的神经网络评估次数
+        self._n_evaluations = 0  # 这一步神经网络评估的次数
+        self.move_stats = []  # 每一步的统计数据
+
+    def _playout(self, state):
+        """
+        执行一次蒙特卡洛搜索，找到一个叶子节点，并更新路径上所有节点的值。
+        :param state: 一个Board对象，在搜索过程中这个Board对象的状态会随之改变，所以这个参数传进来前需要复制一份，或者在搜索后撤销执行过的动作。
+        :return: 这次搜索在state上执行的动作数量
+        """
+        path = self._select_leaf(state)
+        end, winner = state.game_end()
+        if end:
+            if winner == -1:  # 平局V值为0
+                leaf_value = 0.0
+            else:
+                leaf_value = (1.0 if winner == state.get_current_player() else -1.0)  # 当前玩家赢了V值为1，输了V值为-1
+            self._backup_path(path, -leaf_value)
+        elif not self._backup_cached(path, state):
+            action_probs, leaf_value = self._policy(state)
+            leaf_value = np.asarray(leaf_value).item()
+            self._expand_leaf(path[-1], action_probs)
+            self._table[self._leaf_hashes.pop(path[-1])] = (path[-1], leaf_value)
+            self._n_evaluations += 1
+            self._backup_path(path, -leaf_value)
+        return len(path) - 1
+
+    def _select_leaf(self, state):
+        """
+        从根节点开始一直选择Q+u(P)最大的子节点，直到叶子节点，或者回到了路径上已经出现过的局面（四子棋弹出棋子时可能出现）。
+        :param state: 一个Board对象，路径上的动作会在它上面执行
+        :return: 从根节点到叶子节点的路径
+        """
+        node = self._root
+        path = [node]
+        hashes = {state.get_hash()}
+        while not node.is_leaf():
+            action, node = node.select(self._c_puct)
+            state.do_move(action)
+            path.append(node)
+            if state.get_hash() in hashes:  # 局面重复，子节点共用时继续往下会走不出这个环
+                break
+            hashes.add(state.get_hash())
+        return path
+
+    def _backup_cached(self, path, state):
+        """
+        在置换表里查叶子节点的局面，找到了就共用那个节点的子节点，并用缓存的V值更新路径。
+        :param path: 从根节点到叶子节点的路径
+        :param state: 一个Board对象，处于叶子节点的局面
+        :return: 是否已经更新了这条路径
+        """
+        leaf = path[-1]
+        board_hash = state.get_hash()
+        self._n_lookups += 1
+        if board_hash not in self._table:
+            self._leaf_hashes[leaf] = board_hash  # 评估完后存进置换表
+            return False
+        node, leaf_value = self._table[board_hash]
+        if leaf.is_leaf():
+            leaf._children = node._children
+        self._n_hits += 1
+        self._backup_path(path, -leaf_value)
+        return True
+
+    def _expand_and_backup(self, paths, legal_moves, act_probs, values):
+        """
+        用神经网络的评估结果展开这些叶子节点，去掉虚拟损失并更新路径上所有节点的值，再把这些局面存进置换表。
+        """
+        MCTS._expand_and_backup(self, paths, legal_moves, act_probs, values)
+        for path, value in zip(paths, values):
+            self._table[self._leaf_hashes.pop(path[-1])] = (path[-1], np.asarray(value).item())
+        self._n_evaluations += len(paths)
+
+    def _backup_path(self, path, leaf_value):
+        """
+        沿着路径从叶子节点往根节点更新所有节点的值。
+        :param path: 从根节点到叶子节点的路径
+        :param leaf_value: 从叶子节点的父节点玩家视角的评估值
+        """
+        for node in reversed(path):
+            node.update(leaf_value)
+            leaf_value = -leaf_value
+
+    def _move_probs(self, temp):
+        """
+        根据根节点所有子节点的N值计算每个动作的概率pi值，并记下这一步的置换表统计数据。
+        :param temp: 在范围(0, 1]的温度值
+        :return: 所有动作值和所有动作相应的所有概率pi值
+        """
+        n_calls = self._n_hits + self._n_evaluations
+        self.move_stats.append({
+            "lookups": self._n_lookups,
+            "hits": self._n_hits,
+            "hit_rate": self._n_hits / self._n_lookups if self._n_lookups else 0.0,
+            "nn_calls": self._n_evaluations,
+            "nn_calls_saved": self._n_hits / n_calls if n_calls else 0.0,  # 和不用置换表相比神经网络评估次数减少的比例
+        })
+        self._n_lookups, self._n_hits, self._n_evaluations = 0, 0, 0
+        return MCTS._move_probs(self, temp)
+
+    def update_with_move(self, last_move):
+        """
+        根据行动值更新树，继续使用子树，置换表只保留子树里还用得到的项。丢掉整棵树时也清空置换表。
+        :param last_move: 上一次行动值
+        """
+        if last_move in self._root._children:
+            self._root = self._root._children[last_move]
+            self._root._parent = None
+            self._prune_table()
+        else:
+            self._root = TreeNode(None, 1.0)
+            self._table = {}
+
+    def _prune_table(self):
+        """
+        删除置换表里新根节点的子树用不到的项。一个项的子节点还在子树里（它自己或者共用它的子节点的叶子节点在子树里）时保留，
+        否则这个局面已经走不到了，留着只会让置换表一直变大。
+        """
+        reachable = set()  # 子树里所有节点的_children的id，共用子节点的节点的_children是同一个对象
+        stack = [self._root]
+        while stack:
+            children = stack.pop()._children
+            if id(children) not in reachable:
+                reachable.add(id(children))
+                stack.extend(children.values())
+        self._table = {board_hash: entry for board_hash, entry in self._table.items() if id(entry[0]._children) in reachable}
+
+    def __str__(self):
+        return "TranspositionMCTS"
@@ -1,13 +1,222 @@
+import numpy as np
+import tensorflow as tf
+
+output_node_names = ["action_fc/LogSoftmax", "evaluation_fc2/Tanh"]  # 所有神经网络的两个输出，*PretrainedPolicyValueNet按这两个名字读取
+intra_op_threads = 0  # 一个运算内部用的线程数，0表示由tensorflow决定
+inter_op_threads = 0  # 同时执行的运算数，0表示由tensorflow决定
+
+
+def set_session_threads(intra_op, inter_op):
+    """
+    设置之后create_session创建的session的线程数。同一台机器上跑很多个自我对局进程时，每个进程设成1可以避免线程互相抢CPU。
+    :param intra_op: 一个运算内部用的线程数，0表示由tensorflow决定
+    :param inter_op: 同时执行的运算数，0表示由tensorflow决定
+    """
+    global intra_op_threads, inter_op_threads
+    intra_op_threads, inter_op_threads = intra_op, inter_op
+
+
+def create_session(graph=None, intra_op=None, inter_op=None):
+    """
+    所有神经网络都用这个函数创建session。
+    :param graph: session用的计算图，为None时用默认计算图
+    :param intra_op: 一个运算内部用的线程数，为None时用set_session_threads设置的值
+    :param inter_op: 同时执行的运算数，为None时用set_session_threads设置的值
+    :return: tf.Session对象
+    """
+    config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_threads if intra_op is None else intra_op,
+                            inter_op_parallelism_threads=inter_op_threads if inter_op is None else inter_op)
+    return tf.Session(graph=graph, config=config)
+
+
+def freeze_graph_def(policy_value_net):
+    """
+    把神经网络当前的参数合并进计算图，只留下从输入到两个输出的部分，没有损失函数，优化器和L2正则项。
+    结果和utility/merge_model.py生成的graph.bytes一样。
+    :param policy_value_net: 具体某个游戏的PolicyValueNet对象
+    :return: GraphDef对象
+    """
+    session = policy_value_net.session
+    return tf.graph_util.convert_variables_to_constants(session, session.graph.as_graph_def(), output_node_names)
+
+
+def load_graph_def(graph_file):
+    """
+    :param graph_file: graph.bytes文件路径
+    :return: GraphDef对象
+    """
+    graph_def = tf.GraphDef()
+    with open(graph_file, "rb") as file:
+        graph_def.ParseFromString(file.read())
+    return graph_def
+
+
+class InferencePolicyValueNet:
+    """
+    只做前向计算的神经网络，放在自己的计算图和session里，计算图只有合并了参数的输入到两个输出的部分，可以单独设置线程数。
+    也是各个游戏的*PretrainedPolicyValueNet的基类，它们从graph.bytes载入计算图。
+    policy_value用session.make_callable调用，省掉每次session.run解析参数的开销。
+    """
+
+    def __init__(self, graph_def, state_shape, intra_op=None, inter_op=None, name="inference"):
+        """
+        :param graph_def: freeze_graph_def或load_graph_def返回的GraphDef对象
+        :param state_shape: 一个棋局状态的形状，例如(4, 10, 10)
+        :param intra_op: 一个运算内部用的线程数，为None时用set_session_threads设置的值
+        :param inter_op: 同时执行的运算数，为None时用set_session_threads设置的值
+        :param name: 导入的计算图里所有节点名字的前缀
+        """
+        self.state_buffer = np.zeros((1,) + tuple(state_shape), dtype=np.float32)  # policy_value_fn用的输入，避免每次分配
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name=name)
+        self.session = create_session(self.graph, intra_op, inter_op)
+        self.input_states = self.graph.get_tensor_by_name(name + "/input_states:0")
+        self.action_fc = self.graph.get_tensor_by_name(name + "/" + output_node_names[0] + ":0")
+        self.evaluation_fc2 = self.graph.get_tensor_by_name(name + "/" + output_node_names[1] + ":0")
+        self._run_policy_value = self.session.make_callable([self.action_fc, self.evaluation_fc2], feed_list=[self.input_states])
+
+    def policy_value(self, state_batch):
+        log_act_probs, value = self._run_policy_value(state_batch)
+        act_probs = np.exp(log_act_probs)
+        return act_probs, value
+
+    def policy_value_fn(self, board):
+        legal_moves = board.get_available_moves()
+        board.current_state(out=self.state_buffer[0])
+        act_probs, value = self.policy_value(self.state_buffer)
+        act_probs = zip(legal_moves, act_probs[0][legal_moves])
+        return act_probs, value
 
 
 class PolicyValueNet():
+    """
+    所有游戏共用的可训练神经网络，结构由参数决定：
+    普通卷积网络是几个名字为conv1，conv2，...（或者conv_names给的名字）的3x3卷积层；残差网络是一个3x3卷积层加几个残差块，每个卷积层后面有batch normalization，
+    层的名字由tf.layers自动取（conv2d，conv2d_1，...，batch_normalization，...），和原来GobangPolicyValueNet2的变量名相同。
+    后面接P数组输出（1x1卷积，全连接层action_fc）和v值输出（1x1卷积，全连接层evaluation_fc1和evaluation_fc2）。
+    两个输出的名字固定，合并成graph.bytes后*PretrainedPolicyValueNet可以读取。
+    """
+
+    def __init__(self, input_planes, board_height, board_width, n_actions,
+                 conv_filters=(32, 64, 128),
+                 residual_blocks=0,
+                 residual_filters=64,
+                 action_filters=4,
+                 evaluation_filters=2,
+                 evaluation_units=64,
+                 conv_names=None,
+                 model_file=None):
+        """
+        :param input_planes: 棋局状态的特征平面数量
+        :param board_height: 棋盘高度
+        :param board_width: 棋盘宽度
+        :param n_actions: 动作数量
+        :param conv_filters: 普通卷积网络每个卷积层的输出通道数
+        :param residual_blocks: 残差块的数量，大于0时用残差网络，不用conv_filters
+        :param residual_filters: 残差网络每个卷积层的输出通道数
+        :param action_filters: P数组输出的1x1卷积的输出通道数
+        :param evaluation_filters: v值输出的1x1卷积的输出通道数
+        :param evaluation_units: evaluation_fc1的单元数
+        :param conv_names: 普通卷积网络每个卷积层的名字，为None时是conv1，conv2，...，和已有检查点的变量名一致
+        :param model_file: 不为None时载入这个模型
+        """
+        self.board_width = board_width
+        self.board_height = board_height
+        self.state_buffer = np.zeros((1, input_planes, board_height, board_width), dtype=np.float32)  # policy_value_fn用的输入，避免每次分配
+
+        # 定义网络结构
+        # 1. 输入
+        self.input_states = tf.placeholder(tf.float32, shape=[None, input_planes, board_height, board_width], name="input_states")
+        self.input_state = tf.transpose(self.input_states, [0, 2, 3, 1], name="input_state")
+        # 2. 中间层
+        if residual_blocks > 0:
+            X = self._conv_bn(self.input_state, residual_filters, 3)
+            for i in range(residual_blocks):
+                X = self._residual_block(X, residual_filters)
+        else:
+            X = self.input_state
+            conv_names = conv_names or ["conv{}".format(i + 1) for i in range(len(conv_filters))]
+            for filters, name in zip(conv_filters, conv_names):
+                X = tf.layers.conv2d(inputs=X, filters=filters, kernel_size=[3, 3], padding="same",
+                                     data_format="channels_last", activation=tf.nn.relu, name=name)
+        # 3. P数组输出
+        Y = self._head_conv(X, action_filters, "action_conv", residual_blocks > 0)
+        self.action_conv_flat = tf.reshape(Y, [-1, action_filters * board_height * board_width], name="action_conv_flat")
+        self.action_fc = tf.layers.dense(inputs=self.action_conv_flat, units=n_actions, activation=tf.nn.log_softmax, name="action_fc")
+        # 4. v值输出
+        Y = self._head_conv(X, evaluation_filters, "evaluation_conv", residual_blocks > 0)
+        self.evaluation_conv_flat = tf.reshape(Y, [-1, evaluation_filters * board_height * board_width], name="evaluation_conv_flat")
+        self.evaluation_fc1 = tf.layers.dense(inputs=self.evaluation_conv_flat, units=evaluation_units, activation=tf.nn.relu,
+                                              name="evaluation_fc1")
+        self.evaluation_fc2 = tf.layers.dense(inputs=self.evaluation_fc1, units=1, activation=tf.nn.tanh, name="evaluation_fc2")
+
+        # 定义损失函数
+        # 1. v值损失函数
+        self.labels = tf.placeholder(tf.float32, shape=[None, 1], name="labels")  # 标记游戏的输赢，对应self.evaluation_fc2
+        self.value_loss = tf.losses.mean_squared_error(self.labels, self.evaluation_fc2)
+        # 2. P数组损失函数
+        self.mcts_probs = tf.placeholder(tf.float32, shape=[None, n_actions], name="mcts_probs")
+        self.policy_loss = tf.negative(tf.reduce_mean(tf.reduce_sum(tf.multiply(self.mcts_probs, self.action_fc), 1)), name="policy_loss")
+        # 3. L2正则项
+        l2_penalty_beta = 1e-4
+        vars = tf.trainable_variables()
+        l2_penalty = l2_penalty_beta * tf.add_n([tf.nn.l2_loss(v) for v in vars if 'bias' not in v.name.lower()])
+        # 4. 所有加起来成为损失函数
+        self.loss = self.value_loss + self.policy_loss + l2_penalty
+
+        # 计算熵值
+        self.entropy = tf.negative(tf.reduce_mean(tf.reduce_sum(tf.exp(self.action_fc) * self.action_fc, 1)), name="entropy")
+
+        # 训练用的优化器
+        self.learning_rate = tf.placeholder(tf.float32, name="learning_rate")
+        self.optimizer = tf.train.AdamOptimizer(learning_rate=self.learning_rate, name="optimizer").minimize(self.loss)
+
+        # tensorflow的session
+        self.session = create_session()
+        self.session.run(tf.global_variables_initializer())
+        self._run_policy_value = self.session.make_callable([self.action_fc, self.evaluation_fc2], feed_list=[self.input_states])
+
+        # 模型的存储
+        self.saver = tf.train.Saver(max_to_keep=123456789)  # max_to_keep设置一个很大的值防止保存的中间模型被删除
+        if model_file is not None:
+            self.restore_model(model_file)
+
+    def _conv_bn(self, input, filters, kernel_size, relu=True):
+        """
+        残差网络的卷积层：卷积，batch normalization，relu。
+        """
+        X = tf.layers.conv2d(inputs=input, filters=filters, kernel_size=[kernel_size, kernel_size], padding="same",
+                             data_format="channels_last")
+        X = tf.layers.batch_normalization(X, axis=3)
+        return tf.nn.relu(X) if relu else X
+
+    def _head_conv(self, input, filters, name, residual):
+        """
+        输出前的1x1卷积层，残差网络里和其他层一样没有名字，后面有batch normalization。
+        """
+        if residual:
+            return self._conv_bn(input, filters, 1)
+        return tf.layers.conv2d(inputs=input, filters=filters, kernel_size=[1, 1], padding="same",
+                                data_format="channels_last", activation=tf.nn.relu, name=name)
+
+    def _residual_block(self, input, filters):
+        """
+        残差块：两个卷积层，加上输入后再relu。
+        """
+        X = self._conv_bn(input, filters, 3)
+        X = self._conv_bn(X, filters, 3, relu=False)
+        add = tf.add(X, input)
+        return tf.nn.relu(add)
 
     def policy_value(self, state_batch):
         """
         :param state_batch: 一堆棋局
         :return: 一堆动作P值和局面V值
         """
-        pass
+        log_act_probs, value = self._run_policy_value(state_batch)  # make_callable省掉每次session.run解析参数的开销
+        act_probs = np.exp(log_act_probs)
+        return act_probs, value
 
     def policy_value_fn(self, board):
         """
@@ -15,29 +224,81 @@ class PolicyValueNet():
         :param board: 棋局
         :return: (action, probability)列表和v值
         """
-        pass
+        legal_moves = board.get_available_moves()
+        board.current_state(out=self.state_buffer[0])
+        act_probs, value = self.policy_value(self.state_buffer)
+        act_probs = zip(legal_moves, act_probs[0][legal_moves])
+        return act_probs, value
 
-    def train_step(self, state_batch, mcts_probs, winner_batch, lr):
+    def train_step(self, state_batch, mcts_probs, winner_batch, lr, return_policy_value=False):
         """
         训练一下。
         :param state_batch: 输入给神经网络的数据
         :param mcts_probs: 动作概率标签
         :param winner_batch: 胜率标签
         :param lr: 学习速度
-        :return: 损失函数值和熵值
+        :param return_policy_value: 是否同时返回更新参数前这批数据的动作P值和局面V值，和训练在同一次session.run里计算
+        :return: 损失函数值和熵值，return_policy_value为True时还有一堆动作P值和局面V值
         """
-        pass
+        winner_batch = np.reshape(winner_batch, (-1, 1))
+        fetches = [self.loss, self.entropy, self.optimizer]
+        if return_policy_value:  # 训练用的前向计算里已经有更新参数前的输出，一起取出来
+            fetches += [self.action_fc, self.evaluation_fc2]
+        results = self.session.run(
+                fetches,
+                feed_dict={self.input_states: state_batch,
+                           self.mcts_probs: mcts_probs,
+                           self.labels: winner_batch,
+                           self.learning_rate: lr})
+        if return_policy_value:
+            return results[0], results[1], np.exp(results[3]), results[4]
+        return results[0], results[1]
 
     def save_model(self, model_path):
         """
         保存模型。
         :param model_path: 模型保存路径
         """
-        pass
+        self.saver.save(self.session, model_path)
 
     def restore_model(self, model_path):
         """
         载入模型。
         :param model_path: 模型载入路径
         """
-        pass
+        self.saver.restore(self.session, model_path)
+
+    def get_weights(self):
+        """
+        得到神经网络的参数（不包括优化器的参数），用来复制给别的进程里同样结构的神经网络。
+        :return: numpy数组列表
+        """
+        return self.session.run(self._network_variables())
+
+    def set_weights(self, weights):
+        """
+        设置神经网络的参数。
+        :param weights: get_weights返回的numpy数组列表
+        """
+        if not hasattr(self, "_weight_placeholders"):  # 第一次调用时创建赋值操作，以后一直复用
+            with self.session.graph.as_default():
+                variables = self._network_variables()
+                self._weight_placeholders = [tf.placeholder(v.dtype.base_dtype, v.shape) for v in variables]
+                self._assign_weights = [v.assign(p) for v, p in zip(variables, self._weight_placeholders)]
+        self.session.run(self._assign_weights, feed_dict=dict(zip(self._weight_placeholders, weights)))
+
+    def get_checkpoint_values(self):
+        """
+        得到保存模型时要保存的所有变量的值（包括优化器的参数），可以交给CheckpointManager在别的线程里写到磁盘上。
+        :return: 键是变量名，值是numpy数组的字典
+        """
+        variables = self.session.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+        return dict(zip([v.op.name for v in variables], self.session.run(variables)))
+
+    def _network_variables(self):
+        """
+        :return: 神经网络的所有可训练变量和batch normalization的滑动平均变量
+        """
+        graph = self.session.graph
+        variables = graph.get_collection(tf.GraphKeys.TRAINABLE_VARIABLES)
+        return variables + [v for v in graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES) if "moving_" in v.name]
@@ -0,0 +1,301 @@
+import re
+
+import numpy as np
+
+bn_epsilon = 1e-3  # tf.layers.batch_normalization默认的epsilon
+
+
+def load_graph_weights(graph_file):
+    """
+    从合并后的graph.bytes里读出所有参数。合并时变量变成了同名的常量。
+    :param graph_file: graph.bytes文件路径
+    :return: 键是变量名，值是numpy数组的字典
+    """
+    import tensorflow as tf  # 只有读取tensorflow的文件时才需要tensorflow
+    graph_def = tf.GraphDef()
+    with open(graph_file, "rb") as file:
+        graph_def.ParseFromString(file.read())
+    return {node.name: tf.make_ndarray(node.attr["value"].tensor) for node in graph_def.node if node.op == "Const"}
+
+
+def load_checkpoint_weights(model_path):
+    """
+    从save_model保存的检查点里读出所有参数。
+    :param model_path: 模型路径，和restore_model的参数一样
+    :return: 键是变量名，值是numpy数组的字典
+    """
+    import tensorflow as tf  # 只有读取tensorflow的文件时才需要tensorflow
+    reader = tf.train.load_checkpoint(model_path)
+    return {name: reader.get_tensor(name) for name in reader.get_variable_to_shape_map()}
+
+
+def load_npz_weights(npz_file):
+    """
+    读出NumpyPolicyValueNet.save_weights保存的参数，不需要tensorflow。
+    :param npz_file: .npz文件路径
+    :return: 键是变量名，值是numpy数组的字典
+    """
+    with np.load(npz_file) as data:
+        return {name: data[name] for name in data.files}
+
+
+def layer_name(base, i):
+    """
+    :return: tf.layers给第i个没有名字的base层取的名字，例如conv2d，conv2d_1，conv2d_2
+    """
+    return base if i == 0 else "{}_{}".format(base, i)
+
+
+class NumpyPolicyValueNet:
+    """
+    只用numpy做前向计算的神经网络，可以代替*PretrainedPolicyValueNet用来下棋和评估，不需要tensorflow的session。
+    支持五子棋，四子棋，翻转棋和井字棋的卷积网络，以及GobangPolicyValueNet2的残差网络。
+    3x3卷积用im2col变成一次矩阵乘法，batch normalization在载入时合并进前面卷积层的参数。
+    中间数组和tensorflow一样是NHWC的，所以展平的顺序和tf.reshape相同。
+    补零用的数组会被重复使用，所以同一个对象不能同时在多个线程里调用policy_value。
+    """
+
+    def __init__(self, weights, board_width, board_height=None):
+        """
+        :param weights: 键是变量名，值是numpy数组的字典，例如load_graph_weights的返回值，或者PolicyValueNet.get_checkpoint_values()
+        :param board_width: 棋盘宽度
+        :param board_height: 棋盘高度，为None时和宽度一样
+        """
+        self.board_width = board_width
+        self.board_height = board_width if board_height is None else board_height
+        self.weights = {}  # 前向计算用到的参数，不包括优化器的参数
+        self.residual = "conv2d/kernel" in weights  # GobangPolicyValueNet2的层没有名字
+        if self.residual:
+            n_convs = len([name for name in weights if re.match(r"conv2d(_\d+)?/kernel$", name)])
+            convs = [self._fuse(weights, layer_name("conv2d", i), layer_name("batch_normalization", i)) for i in range(n_convs)]
+            self.trunk = convs[:-2]  # 第一层后面每两层是一个残差块
+            self.action_conv, self.evaluation_conv = convs[-2:]
+        else:
+            names = sorted((name[:-len("/kernel")] for name in weights if re.match(r"conv\d*/kernel$", name)),
+                           key=lambda name: int(name[4:] or 0))
+            self.trunk = [self._fuse(weights, name) for name in names]
+            self.action_conv = self._fuse(weights, "action_conv")
+            self.evaluation_conv = self._fuse(weights, "evaluation_conv")
+        self.action_fc = self._dense(weights, "action_fc")
+        self.evaluation_fc1 = self._dense(weights, "evaluation_fc1")
+        self.evaluation_fc2 = self._dense(weights, "evaluation_fc2")
+        channels = self.trunk[0][0].shape[0] // 9
+        self.state_buffer = np.zeros((1, channels, self.board_height, self.board_width), dtype=np.float32)  # policy_value_fn用的输入，避免每次分配
+        self._padded = {}  # 3x3卷积用的补零数组，键是形状，边上一直是0
+
+    def _fuse(self, weights, conv_name, bn_name=None):
+        """
+        读出一个卷积层，后面有batch normalization时合并进卷积的参数：w' = w * gamma / sqrt(var + eps)，b' = (b - mean) * gamma / sqrt(var + eps) + beta。
+        :return: (形状为(kh * kw * 输入通道, 输出通道)的矩阵, 偏置)
+        """
+        self._use(weights, conv_name, ["kernel", "bias"])
+        kernel = weights[conv_name + "/kernel"].astype(np.float64)
+        bias = weights[conv_name + "/bias"].astype(np.float64)
+        if bn_name is not None:
+            self._use(weights, bn_name, ["gamma", "beta", "moving_mean", "moving_variance"])
+            scale = weights[bn_name + "/gamma"] / np.sqrt(weights[bn_name + "/moving_variance"].astype(np.float64) + bn_epsilon)
+            kernel = kernel * scale
+            bias = (bias - weights[bn_name + "/moving_mean"]) * scale + weights[bn_name + "/beta"]
+        return kernel.reshape(-1, kernel.shape[-1]).astype(np.float32), bias.astype(np.float32)
+
+    def _dense(self, weights, name):
+        """
+        :return: 全连接层的(矩阵, 偏置)
+        """
+        self._use(weights, name, ["kernel", "bias"])
+        return weights[name + "/kernel"].astype(np.float32), weights[name + "/bias"].astype(np.float32)
+
+    def _use(self, weights, layer, variables):
+        """
+        记下一层用到的参数，save_weights只保存这些参数。
+        """
+        for variable in variables:
+            name = layer + "/" + variable
+            self.weights[name] = np.asarray(weights[name])
+
+    def save_weights(self, npz_file):
+        """
+        把前向计算用到的参数保存成.npz文件，以后用load_npz_weights读出，不需要tensorflow。
+        :param npz_file: .npz文件路径
+        """
+        np.savez(npz_file, **self.weights)
+
+    def layers(self):
+        """
+        :return: (层名, 层的参数)列表，按前向计算的顺序
+        """
+        return ([("trunk_{}".format(i), layer) for i, layer in enumerate(self.trunk)] +
+                [("action_conv", self.action_conv), ("evaluation_conv", self.evaluation_conv), ("action_fc", self.action_fc),
+                 ("evaluation_fc1", self.evaluation_fc1), ("evaluation_fc2", self.evaluation_fc2)])
+
+    def nbytes(self):
+        """
+        :return: 前向计算用的参数占用的字节数
+        """
+        return sum(array.nbytes for name, layer in self.layers() for array in layer)
+
+    def _matmul(self, x, layer):
+        """
+        :param x: 形状为(N, 输入)的输入
+        :param layer: 层的参数
+        :return: x乘以矩阵再加偏置
+        """
+        matrix, bias = layer
+        y = np.dot(x, matrix)
+        y += bias
+        return y
+
+    def _conv(self, x, layer, relu=True):
+        """
+        :param x: 形状为(N, H, W, C)的输入
+        :param layer: 层的参数，矩阵的形状为(kh * kw * 输入通道, 输出通道)
+        :param relu: 是否接着做relu
+        :return: 形状为(N, H, W, 输出通道)的输出
+        """
+        n, height, width, channels = x.shape
+        if layer[0].shape[0] == channels:  # 1x1卷积
+            y = self._matmul(x.reshape(-1, channels), layer)
+        else:  # 3x3卷积，padding="same"
+            padded = self._padded.get((x.shape, x.dtype))
+            if padded is None:
+                padded = self._padded[(x.shape, x.dtype)] = np.zeros((n, height + 2, width + 2, channels), dtype=x.dtype)
+            padded[:, 1:-1, 1:-1, :] = x
+            s = padded.strides
+            patches = np.lib.stride_tricks.as_strided(padded, shape=(n, height, width, 3, 3, channels),
+                                                      strides=(s[0], s[1], s[2], s[1], s[2], s[3]))
+            y = self._matmul(patches.reshape(-1, 9 * channels), layer)  # im2col，顺序和kernel的(kh, kw, C)相同
+        if relu:
+            np.maximum(y, 0, out=y)
+        return y.reshape(n, height, width, -1)
+
+    def policy_value(self, state_batch):
+        """
+        :param state_batch: 一堆棋局
+        :return: 一堆动作P值和局面V值
+        """
+        x = np.asarray(state_batch, dtype=np.float32).transpose(0, 2, 3, 1)
+        n = len(x)
+        if self.residual:
+            x = self._conv(x, self.trunk[0])
+            for i in range(1, len(self.trunk), 2):
+                y = self._conv(x, self.trunk[i])
+                y = self._conv(y, self.trunk[i + 1], relu=False)
+                y += x
+                x = np.maximum(y, 0, out=y)
+        else:
+            for layer in self.trunk:
+                x = self._conv(x, layer)
+        # P数组输出
+        logits = np.asarray(self._matmul(self._conv(x, self.action_conv).reshape(n, -1), self.action_fc), dtype=np.float32)
+        logits -= logits.max(axis=1, keepdims=True)
+        log_act_probs = logits - np.log(np.sum(np.exp(logits), axis=1, keepdims=True))
+        # v值输出
+        y = self._matmul(self._conv(x, self.evaluation_conv).reshape(n, -1), self.evaluation_fc1)
+        y = self._matmul(np.maximum(y, 0), self.evaluation_fc2)
+        return np.exp(log_act_probs), np.tanh(np.asarray(y, dtype=np.float32))
+
+    def policy_value_fn(self, board):
+        legal_moves = board.get_available_moves()
+        board.current_state(out=self.state_buffer[0])
+        act_probs, value = self.policy_value(self.state_buffer)
+        act_probs = zip(legal_moves, act_probs[0][legal_moves])
+        return act_probs, value
+
+
+def quantize_layer(layer):
+    """
+    把一层的矩阵按输出通道量化成int8：每个输出通道一个缩放系数，最大的绝对值对应127。
+    :param layer: (矩阵, 偏置)
+    :return: (int8矩阵, 每个输出通道的缩放系数, 偏置)
+    """
+    matrix, bias = layer
+    scale = np.max(np.abs(matrix), axis=0) / 127
+    scale[scale == 0] = 1
+    return np.round(matrix / scale).astype(np.int8), scale.astype(np.float32), bias
+
+
+def quantize_rows(x):
+    """
+    把矩阵按行量化成int8范围内的整数：每行一个缩放系数，最大的绝对值对应127。
+    :param x: 形状为(N, 输入)的矩阵
+    :return: (值是整数的float32矩阵, 形状为(N, 1)的缩放系数)
+    """
+    x = np.asarray(x, dtype=np.float32)
+    scale = np.maximum(np.max(x, axis=1), -np.min(x, axis=1))[:, np.newaxis] / 127
+    scale[scale == 0] = 1
+    x = x / scale
+    np.rint(x, out=x)
+    return x, scale
+
+
+class QuantizedPolicyValueNet(NumpyPolicyValueNet):
+    """
+    参数量化成int8的NumpyPolicyValueNet，用来在一台机器上同时跑更多的对局。
+    合并batch normalization之后再按输出通道量化，每层保存int8矩阵，float32的缩放系数和偏置，参数大约是原来的四分之一。
+    计算时int8矩阵转成float32相乘，结果再乘缩放系数。float16_activations为True时层与层之间的中间结果存成float16。
+    int8_activations为True时每层的输入也按行量化成int8（每行一个缩放系数），做int8乘int8的整数矩阵乘法，结果再乘两个缩放系数。
+    numpy的整数矩阵乘法不用BLAS，所以整数存成float32用BLAS算：每次最多exact_rows行，乘积的和不超过2^24，
+    float32能精确表示，结果和用int32累加完全相同。
+    """
+
+    exact_rows = 1024  # 1024 * 127 * 127 < 2^24
+
+    def __init__(self, weights, board_width, board_height=None, float16_activations=False, int8_activations=False):
+        """
+        :param weights: 键是变量名，值是numpy数组的字典，和NumpyPolicyValueNet一样，也可以是QuantizedPolicyValueNet.save_weights保存的参数
+        :param board_width: 棋盘宽度
+        :param board_height: 棋盘高度，为None时和宽度一样
+        :param float16_activations: 中间结果是否存成float16
+        :param int8_activations: 每层的输入是否也量化成int8，做整数矩阵乘法
+        """
+        self.activation_dtype = np.float16 if float16_activations else np.float32
+        self.int8_activations = int8_activations
+        if "action_fc/scale" in weights:  # 已经量化过的参数
+            self.board_width = board_width
+            self.board_height = board_width if board_height is None else board_height
+            self.residual = bool(weights["residual"])
+            layer = lambda name: (weights[name + "/kernel"], weights[name + "/scale"], weights[name + "/bias"])
+            self.trunk = [layer("trunk_{}".format(i)) for i in range(len([name for name in weights if name.endswith("/scale")]) - 5)]
+            self.action_conv, self.evaluation_conv = layer("action_conv"), layer("evaluation_conv")
+            self.action_fc, self.evaluation_fc1, self.evaluation_fc2 = layer("action_fc"), layer("evaluation_fc1"), layer("evaluation_fc2")
+            channels = self.trunk[0][0].shape[0] // 9
+            self.state_buffer = np.zeros((1, channels, self.board_height, self.board_width), dtype=np.float32)
+            self._padded = {}
+        else:
+            NumpyPolicyValueNet.__init__(self, weights, board_width, board_height)
+            self.trunk = [quantize_layer(layer) for layer in self.trunk]
+            self.action_conv, self.evaluation_conv = quantize_layer(self.action_conv), quantize_layer(self.evaluation_conv)
+            self.action_fc, self.evaluation_fc1, self.evaluation_fc2 = [
+                quantize_layer(layer) for layer in (self.action_fc, self.evaluation_fc1, self.evaluation_fc2)]
+        self.weights = {"residual": np.array(self.residual)}
+        for name, (kernel, scale, bias) in self.layers():
+            self.weights.update({name + "/kernel": kernel, name + "/scale": scale, name + "/bias": bias})
+
+    def _matmul(self, x, layer):
+        kernel, scale, bias = layer
+        if self.int8_activations:
+            x, x_scale = quantize_rows(x)
+            y = np.zeros((len(x), kernel.shape[1]))  # 每块的结果都是精确的整数，用float64累加也是精确的
+            for start in range(0, kernel.shape[0], self.exact_rows):
+                y += np.dot(x[:, start:start + self.exact_rows], kernel[start:start + self.exact_rows].astype(np.float32))
+            y *= x_scale
+        else:
+            y = np.dot(x, kernel.astype(np.float32))
+        y *= scale
+        y += bias
+        return y.astype(self.activation_dtype, copy=False)
+
+
+def compare_policy_value(policy_value_net, reference_net, state_batch):
+    """
+    比较两个神经网络在同一批棋局上的输出，例如量化后的神经网络和原来的神经网络。
+    :param policy_value_net: 要比较的神经网络
+    :param reference_net: 作为标准的神经网络
+    :param state_batch: 一堆棋局
+    :return: 平均的动作P值KL散度KL(reference || policy_value_net)，V值的均方误差，V值的最大误差
+    """
+    act_probs, value = policy_value_net.policy_value(state_batch)
+    reference_act_probs, reference_value = reference_net.policy_value(state_batch)
+    kl = np.sum(reference_act_probs * (np.log(reference_act_probs + 1e-10) - np.log(act_probs + 1e-10)), axis=1)
+    errors = np.ravel(value) - np.ravel(reference_value)
+    return {"policy_kl": float(np.mean(kl)), "value_mse": float(np.mean(errors ** 2)), "value_max_error": float(np.max(np.abs(errors)))}
@@ -1,5 +1,5 @@
 import numpy as np
-from mcts import MCTS
+from mcts import MCTS, ArrayMCTS, TranspositionMCTS
 
 
 class Player:
@@ -15,14 +15,26 @@ class MCTSPlayer(Player):
     基于蒙特卡洛树的电脑玩家
     """
 
-    def __init__(self, policy_value_function, c_puct=5, n_playout=300, is_selfplay=False):
+    def __init__(self, policy_value_function, c_puct=5, n_playout=300, is_selfplay=False, array_tree=False,
+                 policy_value_batch_function=None, batch_size=1, transposition=False):
         """
         :param policy_value_function: 论文里面的(p,v)=f(s)函数。接受一个board作为参数并返回一个（动作，概率）列表和在[-1, 1]范围的局面胜率的函数
         :param c_puct: 论文里面的c_puct。一个在范围(0, inf)的数字，控制探索等级。值越小越依赖于Q值，值越大越依赖于P值
         :param n_playout: 找MCTS叶子节点次数，即每次搜索次数
         :param is_selfplay: 是否是自己与自己对局
+        :param array_tree: 是否使用用numpy数组存储的蒙特卡洛树ArrayMCTS，结果与MCTS相同但更快更省内存
+        :param policy_value_batch_function: 神经网络的policy_value方法，接受一批棋局状态并返回一批动作P值和局面V值
+        :param batch_size: 每次一起送进神经网络评估的叶子节点数量，大于1时需要提供policy_value_batch_function
+        :param transposition: 是否使用识别相同局面的蒙特卡洛树TranspositionMCTS，不同走法到达的相同局面共用统计数据和神经网络评估，不能和array_tree同时使用
         """
-        self.mcts = MCTS(policy_value_function, c_puct, n_playout)
+        if transposition:
+            if array_tree:
+                raise Exception('array_tree和transposition不能同时使用')
+            self.mcts = TranspositionMCTS(policy_value_function, c_puct, n_playout, policy_value_batch_function, batch_size)
+        elif array_tree:
+            self.mcts = ArrayMCTS(policy_value_function, c_puct, n_playout, policy_value_batch_function, batch_size)
+        else:
+            self.mcts = MCTS(policy_value_function, c_puct, n_playout, policy_value_batch_function, batch_size)
         self._is_selfplay = is_selfplay
 
     def set_player_ind(self, p):
@@ -32,22 +44,37 @@ class MCTSPlayer(Player):
         self.mcts.update_with_move(-1)
 
     def get_action(self, board, temp=1e-3, return_prob=False):
-        move_probs = np.zeros(board.get_action_count())  # alphaGo Zero论文里面由MCTS返回的的pi数组
         if len(board.get_available_moves()) > 0:
             acts, probs = self.mcts.get_move_probs(board, temp)
-            move_probs[list(acts)] = probs
-            if self._is_selfplay:
-                move = np.random.choice(acts, p=0.75*probs + 0.25*np.random.dirichlet(0.3*np.ones(len(probs))))  # 增加一个Dirichlet Noise来探索
-                self.mcts.update_with_move(move)
-            else:
-                move = np.random.choice(acts, p=probs)  # 如果用默认值temp=1e-3，就相当于选择P值最高的动作
-                self.mcts.update_with_move(-1)
-            if return_prob:
-                return move, move_probs
-            else:
-                return move
+            return self._choose_action(board, acts, probs, return_prob)
         else:
             print("WARNING: the board is full")
 
+    def get_action_steps(self, board, temp=1e-3, return_prob=False):
+        """
+        get_action的生成器版本，由调用者负责神经网络评估，用法见MCTS.search。
+        :return: 和get_action的返回值相同
+        """
+        acts, probs = yield from self.mcts.search(board, temp)
+        return self._choose_action(board, acts, probs, return_prob)
+
+    def _choose_action(self, board, acts, probs, return_prob):
+        """
+        根据蒙特卡洛搜索得到的pi值选择动作，并更新蒙特卡洛树。
+        :return: 动作值，return_prob为True时还返回所有动作的pi值
+        """
+        move_probs = np.zeros(board.get_action_count())  # alphaGo Zero论文里面由MCTS返回的的pi数组
+        move_probs[list(acts)] = probs
+        if self._is_selfplay:
+            move = np.random.choice(acts, p=0.75*probs + 0.25*np.random.dirichlet(0.3*np.ones(len(probs))))  # 增加一个Dirichlet Noise来探索
+            self.mcts.update_with_move(move)
+        else:
+            move = np.random.choice(acts, p=probs)  # 如果用默认值temp=1e-3，就相当于选择P值最高的动作
+            self.mcts.update_with_move(-1)
+        if return_prob:
+            return move, move_probs
+        else:
+            return move
+
     def __str__(self):
         return "MCTS {}".format(self.player)
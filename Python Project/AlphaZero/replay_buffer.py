@@ -0,0 +1,155 @@
+import os
+import json
+
+import numpy as np
+
+
+class ReplayBuffer:
+    """
+    训练数据集，一个预分配的环形缓冲区，代替元素为(state, mcts_probs, z)元组的deque。
+    棋局状态，动作概率和z值分别存在三个连续的数组里，满了以后新的数据覆盖最旧的数据。
+    棋局状态的特征平面都是0或1，默认存成uint8。取一批训练数据是一次向量化的索引，结果写到重复使用的数组里。
+    数组在第一次放入数据时按数据的形状分配。
+    """
+
+    def __init__(self, capacity, state_dtype=np.uint8):
+        """
+        :param capacity: 最多保存多少条数据
+        :param state_dtype: 保存棋局状态用的数据类型
+        """
+        self.capacity = capacity
+        self.state_dtype = state_dtype
+        self.states = None  # 棋局状态
+        self.mcts_probs = None  # 动作概率
+        self.winners = None  # z值
+        self.size = 0  # 已经保存的数据数量
+        self.next = 0  # 下一条数据写到哪个位置
+        self._batch = None  # 重复使用的(state_batch, mcts_probs_batch, winner_batch)
+
+    def __len__(self):
+        return self.size
+
+    def _allocate(self, state_shape, n_actions):
+        """
+        分配保存数据的数组。
+        :param state_shape: 一个棋局状态的形状
+        :param n_actions: 动作数量
+        """
+        self.states = np.zeros((self.capacity,) + state_shape, dtype=self.state_dtype)
+        self.mcts_probs = np.zeros((self.capacity, n_actions), dtype=np.float32)
+        self.winners = np.zeros(self.capacity, dtype=np.float32)
+
+    def extend(self, play_data):
+        """
+        放入一批数据，满了时覆盖最旧的数据。
+        :param play_data: (state, mcts_probs, z)列表
+        """
+        play_data = list(play_data)
+        if not play_data:
+            return
+        states = np.array([data[0] for data in play_data])
+        mcts_probs = np.array([data[1] for data in play_data])
+        winners = np.array([data[2] for data in play_data])
+        if self.states is None:
+            self._allocate(states.shape[1:], mcts_probs.shape[1])
+        if len(states) > self.capacity:  # 只有最后capacity条会留下来
+            states, mcts_probs, winners = states[-self.capacity:], mcts_probs[-self.capacity:], winners[-self.capacity:]
+        indices = (self.next + np.arange(len(states))) % self.capacity
+        self.states[indices] = states
+        self.mcts_probs[indices] = mcts_probs
+        self.winners[indices] = winners
+        self.next = (self.next + len(states)) % self.capacity
+        self.size = min(self.size + len(states), self.capacity)
+
+    def sample(self, batch_size, symmetry=None):
+        """
+        随机取batch_size条不重复的数据。返回的数组会在下一次调用sample时被覆盖。
+        :param batch_size: 数据数量
+        :param symmetry: 不为None时每条数据再随机做symmetry的一种对称变换，数据集里每个棋局只需要保存一次
+        :return: state_batch, mcts_probs_batch, winner_batch
+        """
+        indices = np.random.choice(self.size, batch_size, replace=False)
+        if self._batch is None or len(self._batch[0]) != batch_size:
+            self._batch = (np.empty((batch_size,) + self.states.shape[1:], dtype=np.float32),
+                           np.empty((batch_size, self.mcts_probs.shape[1]), dtype=np.float32),
+                           np.empty(batch_size, dtype=np.float32))
+        state_batch, mcts_probs_batch, winner_batch = self._batch
+        np.take(self.winners, indices, out=winner_batch)
+        if symmetry is None:
+            state_batch[...] = self.states[indices]  # uint8转成float32
+            np.take(self.mcts_probs, indices, axis=0, out=mcts_probs_batch)
+        else:  # 每种对称变换的数据一起取，每种只需要沿最后一维做一次索引
+            transforms = np.random.randint(symmetry.n_transforms, size=batch_size)
+            flat_states = state_batch.reshape(batch_size, state_batch.shape[1], -1)
+            for t in range(symmetry.n_transforms):
+                rows = np.flatnonzero(transforms == t)
+                if len(rows):
+                    selected = self.states[indices[rows]]
+                    flat_states[rows] = selected.reshape(selected.shape[:2] + (-1,))[:, :, symmetry.state_permutations[t]]
+                    mcts_probs_batch[rows] = self.mcts_probs[indices[rows]][:, symmetry.action_permutations[t]]
+        return state_batch, mcts_probs_batch, winner_batch
+
+    def nbytes(self):
+        """
+        :return: 保存数据的数组占用的字节数
+        """
+        if self.states is None:
+            return 0
+        return self.states.nbytes + self.mcts_probs.nbytes + self.winners.nbytes
+
+
+class PersistentReplayBuffer(ReplayBuffer):
+    """
+    保存在磁盘上的训练数据集，三个数组是目录里用内存映射打开的.npy文件，另外用index.json记录环形缓冲区的位置。
+    每次放入数据后先把数组写回磁盘，再更新index.json，所以训练进程中途退出后，用同样的目录创建就能接着用原来的数据。
+    取一批训练数据时只会读到需要的那部分文件，数据集可以比内存大。
+    """
+
+    def __init__(self, capacity, directory, state_dtype=np.uint8):
+        """
+        :param capacity: 最多保存多少条数据
+        :param directory: 保存数据的目录，里面已经有数据时载入
+        :param state_dtype: 保存棋局状态用的数据类型
+        """
+        ReplayBuffer.__init__(self, capacity, state_dtype)
+        self.directory = directory
+        index_path = os.path.join(directory, "index.json")
+        if os.path.exists(index_path):
+            with open(index_path) as file:
+                index = json.load(file)
+            if index["capacity"] != capacity:
+                raise Exception('{}里的数据集大小是{}，不是{}'.format(directory, index["capacity"], capacity))
+            self.states = np.lib.format.open_memmap(os.path.join(directory, "states.npy"), mode="r+")
+            self.mcts_probs = np.lib.format.open_memmap(os.path.join(directory, "mcts_probs.npy"), mode="r+")
+            self.winners = np.lib.format.open_memmap(os.path.join(directory, "winners.npy"), mode="r+")
+            self.size, self.next = index["size"], index["next"]
+
+    def _allocate(self, state_shape, n_actions):
+        """
+        在目录里创建保存数据的.npy文件。
+        :param state_shape: 一个棋局状态的形状
+        :param n_actions: 动作数量
+        """
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self.states = np.lib.format.open_memmap(os.path.join(self.directory, "states.npy"), mode="w+",
+                                                dtype=self.state_dtype, shape=(self.capacity,) + state_shape)
+        self.mcts_probs = np.lib.format.open_memmap(os.path.join(self.directory, "mcts_probs.npy"), mode="w+",
+                                                    dtype=np.float32, shape=(self.capacity, n_actions))
+        self.winners = np.lib.format.open_memmap(os.path.join(self.directory, "winners.npy"), mode="w+",
+                                                 dtype=np.float32, shape=(self.capacity,))
+
+    def extend(self, play_data):
+        """
+        放入一批数据，满了时覆盖最旧的数据，并保存到磁盘。
+        :param play_data: (state, mcts_probs, z)列表
+        """
+        ReplayBuffer.extend(self, play_data)
+        if self.states is None:
+            return
+        for array in (self.states, self.mcts_probs, self.winners):
+            array.flush()
+        index_path = os.path.join(self.directory, "index.json")
+        with open(index_path + ".tmp", "w") as file:
+            json.dump({"capacity": self.capacity, "size": self.size, "next": self.next}, file)
+        os.replace(index_path + ".tmp", index_path)  # 替换是原子操作，中途退出也不会留下写了一半的index.json
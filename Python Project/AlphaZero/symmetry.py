@@ -0,0 +1,224 @@
+import numpy as np
+from cache import EvaluationCache
+
+
+class Symmetry:
+    """
+    棋盘的一组对称变换，每种变换存成位置的排列，对棋局状态和动作P值做变换都只是一次numpy的索引。
+    棋局状态按current_state()的方向（行是反过来的）变换，动作值按各自游戏的动作编号变换。
+    具体的对称变换由子类在初始化时给出。
+    """
+
+    def __init__(self, state_permutations, action_permutations):
+        """
+        :param state_permutations: 第t行是变换t后棋局状态每个位置原来在哪个位置
+        :param action_permutations: 第t行是变换t后每个动作原来是哪个动作
+        """
+        self.state_permutations = np.array(state_permutations)
+        self.action_permutations = np.array(action_permutations)
+        self.inverse_action_permutations = np.argsort(self.action_permutations, axis=1)
+        self.n_transforms = len(self.state_permutations)
+
+    def transform_states(self, states, transforms):
+        """
+        对每个棋局状态做各自的对称变换。
+        :param states: 形状为(n, C, 高, 宽)的棋局状态
+        :param transforms: 长度为n的变换编号数组
+        :return: 变换后的棋局状态
+        """
+        states = np.asarray(states)
+        n, channels = states.shape[:2]
+        flat = states.reshape(n, channels, -1)
+        permutations = self.state_permutations[transforms]
+        transformed = flat[np.arange(n)[:, None, None], np.arange(channels)[None, :, None], permutations[:, None, :]]
+        return transformed.reshape(states.shape)
+
+    def all_states(self, states):
+        """
+        :param states: 形状为(n, C, 高, 宽)的棋局状态
+        :return: 形状为(n, 变换数量, C, 高, 宽)的所有对称变换后的棋局状态
+        """
+        states = np.asarray(states)
+        n, channels = states.shape[:2]
+        transformed = states.reshape(n, channels, -1)[:, :, self.state_permutations]
+        return transformed.transpose(0, 2, 1, 3).reshape((n, self.n_transforms) + states.shape[1:])
+
+    def transform_probs(self, probs, transforms):
+        """
+        对每个动作P值数组做各自的对称变换。
+        :param probs: 形状为(n, 动作数量)的动作P值
+        :param transforms: 长度为n的变换编号数组
+        :return: 变换后的动作P值
+        """
+        probs = np.asarray(probs)
+        return probs[np.arange(len(probs))[:, None], self.action_permutations[transforms]]
+
+    def inverse_probs(self, probs, transforms):
+        """
+        transform_probs的逆变换，把变换后棋局的动作P值变回原来棋局的动作P值。
+        :param probs: 形状为(n, 动作数量)的动作P值
+        :param transforms: 长度为n的变换编号数组
+        :return: 原来棋局的动作P值
+        """
+        probs = np.asarray(probs)
+        return probs[np.arange(len(probs))[:, None], self.inverse_action_permutations[transforms]]
+
+    def augment(self, play_data):
+        """
+        通过所有对称变换来增加数据集数量，整局的数据一起变换，每种变换只做一次索引。
+        :param play_data: (state, mcts_probs, z)列表
+        :return: 增加后的(state, mcts_probs, z)列表，每条原数据后面紧跟着它的所有变换，顺序和原来的get_equi_data相同
+        """
+        play_data = list(play_data)
+        if not play_data:
+            return []
+        states = np.array([data[0] for data in play_data])
+        mcts_probs = np.array([data[1] for data in play_data])
+        winners = np.array([data[2] for data in play_data])
+        equi_states = self.all_states(states).reshape((-1,) + states.shape[1:])
+        equi_mcts_probs = mcts_probs[:, self.action_permutations].reshape(-1, mcts_probs.shape[1])
+        return list(zip(equi_states, equi_mcts_probs, np.repeat(winners, self.n_transforms)))
+
+    def canonical_transforms(self, states):
+        """
+        找到每个棋局的标准形式：所有对称变换里，把特征平面压缩成位之后字节序最小的那个。特征平面的值需要都是0或1。
+        :param states: 形状为(n, C, 高, 宽)的棋局状态
+        :return: 变到标准形式的变换编号数组，以及标准形式的字节串列表（可以当作缓存键）
+        """
+        all_states = self.all_states(states)
+        packed = np.packbits(all_states.reshape(all_states.shape[:2] + (-1,)) != 0, axis=2)
+        transforms = np.empty(len(packed), dtype=np.int64)
+        keys = []
+        for i, rows in enumerate(packed):
+            rows = [row.tobytes() for row in rows]
+            transforms[i] = min(range(self.n_transforms), key=rows.__getitem__)
+            keys.append(rows[transforms[i]])
+        return transforms, keys
+
+
+class DihedralSymmetry(Symmetry):
+    """
+    正方形棋盘的8种对称变换：逆时针旋转90，180，270，360度，每种旋转后再水平翻转，顺序和原来五子棋，翻转棋的get_equi_data相同。
+    """
+
+    def __init__(self, width, has_pass=False):
+        """
+        :param width: 棋盘宽度
+        :param has_pass: 最后一个动作是不是不下子（翻转棋），这个动作在所有变换下不变
+        """
+        n = width * width
+        state_index = np.arange(n).reshape(width, width)  # current_state()的方向
+        action_index = np.flipud(state_index)  # 动作值对应的位置在current_state()里的方向
+        state_permutations, action_permutations = [], []
+        for i in [1, 2, 3, 4]:
+            for flip in [False, True]:
+                transform = (lambda grid: np.fliplr(np.rot90(grid, i))) if flip else (lambda grid: np.rot90(grid, i))
+                state_permutations.append(transform(state_index).flatten())
+                action_permutations.append(np.flipud(transform(action_index)).flatten())
+        if has_pass:
+            action_permutations = [np.append(permutation, n) for permutation in action_permutations]
+        Symmetry.__init__(self, state_permutations, action_permutations)
+
+
+class MirrorSymmetry(Symmetry):
+    """
+    四子棋棋盘的2种对称变换：不变和水平翻转，顺序和原来四子棋的get_equi_data相同。
+    前width个动作是在某一列落子，后width个动作是弹出某一列最下面的棋子，翻转时两部分各自反过来。
+    """
+
+    def __init__(self, width, height):
+        """
+        :param width: 棋盘宽度
+        :param height: 棋盘高度
+        """
+        state_index = np.arange(width * height).reshape(height, width)
+        columns = np.arange(width)
+        Symmetry.__init__(self, [state_index.flatten(), np.fliplr(state_index).flatten()],
+                          [np.concatenate([columns, columns + width]), np.concatenate([columns[::-1], columns[::-1] + width])])
+
+
+class SymmetricPolicyValueNet:
+    """
+    利用对称性评估棋局的神经网络，可以代替原来的神经网络使用。
+    默认把每个棋局变成它的标准形式再评估，再把动作P值变回来，这样互相对称的棋局只需要评估一次：
+    如果policy_value_net是EvaluationCache，标准形式按字节串缓存，policy_value_fn和policy_value都会用到缓存。
+    random_symmetry为True时每次评估随机选一种对称变换，不使用缓存，可以减小神经网络对棋盘方向的偏差。
+    其他方法和属性直接转给原来的神经网络。
+    """
+
+    def __init__(self, policy_value_net, symmetry, random_symmetry=False):
+        """
+        :param policy_value_net: 具体某个游戏的PolicyValueNet对象，或者包着它的EvaluationCache
+        :param symmetry: 棋盘的Symmetry对象，例如DihedralSymmetry
+        :param random_symmetry: 是否每次随机选一种对称变换评估
+        """
+        self.policy_value_net = policy_value_net
+        self.symmetry = symmetry
+        self.random_symmetry = random_symmetry
+        self.cache = policy_value_net if isinstance(policy_value_net, EvaluationCache) else None
+        self._n_positions = 0  # 需要评估的棋局数
+        self._n_evaluations = 0  # 实际送进神经网络的棋局数
+
+    def __getattr__(self, name):
+        if name == "policy_value_net":  # 还没有初始化时（例如复制对象时）不要无限递归
+            raise AttributeError(name)
+        return getattr(self.policy_value_net, name)
+
+    def policy_value(self, state_batch):
+        """
+        :param state_batch: 一堆棋局
+        :return: 一堆动作P值和局面V值
+        """
+        states = np.asarray(state_batch, dtype=np.float32)
+        n = len(states)
+        if self.random_symmetry:
+            transforms, keys = np.random.randint(self.symmetry.n_transforms, size=n), None
+        else:
+            transforms, keys = self.symmetry.canonical_transforms(states)
+        act_probs = np.empty((n, self.symmetry.action_permutations.shape[1]), dtype=np.float32)
+        values = np.empty((n, 1), dtype=np.float32)
+        missing = list(range(n))
+        if self.cache is not None and keys is not None:
+            generation = self.cache.generation
+            missing = []
+            for i, key in enumerate(keys):
+                entry = self.cache.get(key)
+                if entry is None:
+                    missing.append(i)
+                else:
+                    act_probs[i], values[i] = entry
+        if missing:
+            probs, value = self.policy_value_net.policy_value(self.symmetry.transform_states(states[missing], transforms[missing]))
+            act_probs[missing] = probs
+            values[missing] = np.reshape(value, (-1, 1))
+            if self.cache is not None and keys is not None:
+                for i, probs_i, value_i in zip(missing, probs, values[missing]):
+                    self.cache.put(keys[i], probs_i, value_i, generation=generation)
+        self._n_positions += n
+        self._n_evaluations += len(missing)
+        return self.symmetry.inverse_probs(act_probs, transforms), values
+
+    def policy_value_fn(self, board):
+        """
+        论文里面的神经网络函数(p,v)=f(s)。
+        :param board: 棋局
+        :return: (action, probability)列表和v值
+        """
+        legal_moves = board.get_available_moves()
+        state_buffer = self.policy_value_net.state_buffer
+        board.current_state(out=state_buffer[0])
+        act_probs, value = self.policy_value(state_buffer)
+        return zip(legal_moves, act_probs[0][legal_moves]), value
+
+    def get_metrics(self):
+        """
+        :return: 统计数据，包括需要评估的棋局数，实际送进神经网络的棋局数和省下的比例，有缓存时还包括缓存的统计数据
+        """
+        metrics = {
+            "positions": self._n_positions,
+            "nn_evaluations": self._n_evaluations,
+            "nn_calls_saved": 1 - self._n_evaluations / self._n_positions if self._n_positions else 0.0,
+        }
+        if self.cache is not None:
+            metrics["cache"] = self.cache.get_metrics()
+        return metrics
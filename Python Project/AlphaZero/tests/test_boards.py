@@ -0,0 +1,70 @@
+import random
+import unittest
+
+import numpy as np
+from Gobang.gobang_game import GobangBoard, GobangBitBoard
+from Connect4.connect4_game import Connect4Board, Connect4BitBoard
+from Reversi.reversi_game import ReversiBoard, ReversiBitBoard
+
+
+class BitBoardTest(unittest.TestCase):
+    """
+    位棋盘和作为标准的原来的棋盘走同样的随机动作，每走一步和每撤销一步都检查它们的结果完全相同。
+    """
+
+    n_games = 100  # 随机对局数
+    max_moves = 200  # 每局最多走多少步，四子棋可以一直弹出棋子不结束
+
+    def assert_same(self, board, reference, message):
+        """
+        :param board: 要检查的棋盘
+        :param reference: 作为标准的棋盘
+        :param message: 出错时显示的是哪一局哪一步
+        """
+        self.assertEqual(list(board.get_available_moves()), list(reference.get_available_moves()), message)
+        self.assertEqual(board.game_end(), reference.game_end(), message)
+        self.assertTrue(np.array_equal(board.current_state(), reference.current_state()), message)
+        self.assertEqual(board.get_hash(), reference.get_hash(), message)
+
+    def compare_boards(self, create_board, create_reference_board, seed=0):
+        """
+        :param create_board: 创建要检查的棋盘的函数
+        :param create_reference_board: 创建作为标准的棋盘的函数
+        :param seed: 随机数种子
+        """
+        rng = random.Random(seed)
+        for i in range(self.n_games):
+            board, reference = create_board(), create_reference_board()
+            board.init_board(i % 2)
+            reference.init_board(i % 2)
+            self.assert_same(board, reference, "第{}局开始".format(i))
+            for j in range(self.max_moves):
+                if reference.game_end()[0]:
+                    break
+                move = rng.choice(list(reference.get_available_moves()))
+                board.do_move(move)
+                reference.do_move(move)
+                self.assert_same(board, reference, "第{}局第{}步".format(i, j))
+                if rng.random() < 0.1:  # 撤销再重新走一遍
+                    board.undo_move()
+                    reference.undo_move()
+                    self.assert_same(board, reference, "第{}局第{}步撤销后".format(i, j))
+                    board.do_move(move)
+                    reference.do_move(move)
+                    self.assert_same(board, reference, "第{}局第{}步撤销后重新走".format(i, j))
+
+    def test_gobang(self):
+        self.compare_boards(lambda: GobangBitBoard(width=10, n_in_row=5), lambda: GobangBoard(width=10, n_in_row=5))
+
+    def test_tictactoe(self):
+        self.compare_boards(lambda: GobangBitBoard(width=3, n_in_row=3), lambda: GobangBoard(width=3, n_in_row=3))
+
+    def test_connect4(self):
+        self.compare_boards(lambda: Connect4BitBoard(), lambda: Connect4Board())
+
+    def test_reversi(self):
+        self.compare_boards(lambda: ReversiBitBoard(width=8), lambda: ReversiBoard(width=8))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,94 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+try:
+    import tensorflow as tf
+except ImportError:  # 作为标准的PolicyValueNet需要tensorflow
+    tf = None
+
+
+@unittest.skipUnless(tf is not None, "需要tensorflow")
+class NumpyPolicyValueNetTest(unittest.TestCase):
+    """
+    NumpyPolicyValueNet的输出要和tensorflow的PolicyValueNet相同，参数分别来自get_checkpoint_values和合并后的graph.bytes。
+    """
+
+    n_states = 16
+    atol = 1e-5
+
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.save_dir)
+
+    def randomize_batch_normalization(self, net, seed=0):
+        """
+        把batch normalization的参数和滑动平均改成随机值，不然刚初始化的网络里它们是0和1，测不出合并是否正确。
+        :param net: PolicyValueNet对象
+        :param seed: 随机数种子
+        """
+        rng = np.random.RandomState(seed)
+        for variable in net.session.graph.get_collection(tf.GraphKeys.GLOBAL_VARIABLES):
+            name = variable.op.name
+            if "batch_normalization" not in name:
+                continue
+            shape = variable.shape.as_list()
+            if name.endswith("gamma"):
+                value = rng.uniform(0.5, 1.5, shape)
+            elif name.endswith("moving_variance"):
+                value = rng.uniform(0.5, 2.0, shape)
+            else:  # beta和moving_mean
+                value = rng.normal(0, 0.2, shape)
+            variable.load(value.astype(np.float32), net.session)
+
+    def compare(self, create_net, residual=False):
+        """
+        :param create_net: 创建PolicyValueNet的函数
+        :param residual: 是否是有batch normalization的残差网络
+        """
+        from model import freeze_graph_def
+        from numpy_net import NumpyPolicyValueNet, load_graph_weights
+        with tf.Graph().as_default():
+            net = create_net()
+            if residual:
+                self.randomize_batch_normalization(net)
+            height = getattr(net, "board_height", None)
+            rng = np.random.RandomState(1)
+            states = (rng.rand(*((self.n_states,) + net.state_buffer.shape[1:])) < 0.3).astype(np.float32)
+            act_probs, value = net.policy_value(states)
+            graph_file = os.path.join(self.save_dir, "graph.bytes")
+            with open(graph_file, "wb") as file:
+                file.write(freeze_graph_def(net).SerializeToString())
+            for weights in (net.get_checkpoint_values(), load_graph_weights(graph_file)):
+                numpy_act_probs, numpy_value = NumpyPolicyValueNet(weights, net.board_width, height).policy_value(states)
+                np.testing.assert_allclose(numpy_act_probs, act_probs, atol=self.atol)
+                np.testing.assert_allclose(numpy_value, value, atol=self.atol)
+
+    def test_gobang(self):
+        from Gobang.gobang_model import GobangPolicyValueNet
+        self.compare(lambda: GobangPolicyValueNet(8))
+
+    def test_gobang_residual(self):
+        from Gobang.gobang_model import GobangPolicyValueNet2
+        self.compare(lambda: GobangPolicyValueNet2(8), residual=True)
+
+    def test_tictactoe(self):
+        from Gobang.gobang_model import TictactoePolicyValueNet
+        self.compare(lambda: TictactoePolicyValueNet())
+
+    def test_connect4(self):
+        from Connect4.connect4_model import Connect4PolicyValueNet
+        self.compare(lambda: Connect4PolicyValueNet())
+
+    def test_reversi(self):
+        from Reversi.reversi_model import ReversiPolicyValueNet
+        self.compare(lambda: ReversiPolicyValueNet(6))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,110 @@
+import random
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+from Gobang.gobang_game import GobangGame, GobangBitBoard
+
+try:
+    import tensorflow
+except ImportError:  # train.py通过model.py和checkpoint.py用到tensorflow
+    tensorflow = None
+
+
+class LinearPolicyValueNet:
+    """
+    代替PolicyValueNet的线性softmax模型，train_step真的会改变参数，并记下执行了几次更新。
+    """
+
+    def __init__(self, n_inputs, n_actions, lr_scale):
+        self.weights = np.random.RandomState(0).randn(n_inputs, n_actions) * 0.1
+        self.lr_scale = lr_scale  # 放大学习速率，让KL经常超过kl_targ*4而提前停止
+        self.n_updates = 0
+
+    def policy_value(self, state_batch):
+        logits = np.reshape(state_batch, (len(state_batch), -1)).dot(self.weights)
+        logits -= logits.max(axis=1, keepdims=True)
+        act_probs = np.exp(logits)
+        act_probs /= act_probs.sum(axis=1, keepdims=True)
+        return act_probs, np.tanh(logits[:, :1])
+
+    def train_step(self, state_batch, mcts_probs, winner_batch, lr, return_policy_value=False):
+        act_probs, value = self.policy_value(state_batch)
+        x = np.reshape(state_batch, (len(state_batch), -1))
+        self.weights -= lr * self.lr_scale * x.T.dot(act_probs - mcts_probs) / len(x)
+        self.n_updates += 1
+        if return_policy_value:
+            return 1.0, 2.0, act_probs, value
+        return 1.0, 2.0
+
+
+def baseline_policy_update(trainer):
+    """
+    没有合并第一次训练和更新前输出时的policy_update，作为对照。
+    :param trainer: Trainer对象
+    :return: 返回损失函数值和熵值
+    """
+    state_batch, mcts_probs_batch, winner_batch = trainer.data_buffer.sample(trainer.batch_size)
+    old_probs, old_v = trainer.policy_value_net.policy_value(state_batch)
+    for i in range(trainer.epochs):
+        loss, entropy = trainer.policy_value_net.train_step(state_batch, mcts_probs_batch, winner_batch,
+                                                            trainer.learn_rate*trainer.lr_multiplier)
+        new_probs, new_v = trainer.policy_value_net.policy_value(state_batch)
+        kl = np.mean(np.sum(old_probs * (np.log(old_probs + 1e-10) - np.log(new_probs + 1e-10)), axis=1))
+        if kl > trainer.kl_targ * 4:
+            break
+    if kl > trainer.kl_targ * 2 and trainer.lr_multiplier > 0.01:
+        trainer.lr_multiplier /= 1.5
+    elif kl < trainer.kl_targ / 2 and trainer.lr_multiplier < 100:
+        trainer.lr_multiplier *= 1.5
+    return loss, entropy
+
+
+@unittest.skipUnless(tensorflow is not None, "需要tensorflow")
+class PolicyUpdateTest(unittest.TestCase):
+    """
+    policy_update的训练过程要和对照完全相同：每次执行的更新次数一样，lr_multiplier的变化一样。
+    """
+
+    width = 6
+    n_updates = 30
+
+    def setUp(self):
+        self.save_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.save_dir)
+
+    def run_updates(self, policy_update):
+        """
+        :param policy_update: 接受Trainer对象，执行一次训练的函数
+        :return: 每次训练执行的更新次数列表和每次训练后的lr_multiplier列表
+        """
+        from train import Trainer
+        n_actions = self.width * self.width
+        net = LinearPolicyValueNet(4 * n_actions, n_actions, lr_scale=50000)
+        trainer = Trainer(GobangGame(GobangBitBoard(self.width, 4)), net, self.save_dir, batch_size=64)
+        rng = np.random.RandomState(1)
+        trainer.data_buffer.extend([((rng.rand(4, self.width, self.width) < 0.3).astype(np.float64),
+                                     rng.dirichlet(np.ones(n_actions)), rng.choice([-1.0, 1.0])) for i in range(500)])
+        np.random.seed(2)
+        random.seed(2)
+        updates, lr_multipliers = [], []
+        for i in range(self.n_updates):
+            n = net.n_updates
+            policy_update(trainer)
+            updates.append(net.n_updates - n)
+            lr_multipliers.append(trainer.lr_multiplier)
+        return updates, lr_multipliers
+
+    def test_same_as_baseline(self):
+        updates, lr_multipliers = self.run_updates(lambda trainer: trainer.policy_update())
+        baseline_updates, baseline_lr_multipliers = self.run_updates(baseline_policy_update)
+        self.assertTrue(any(n < 5 for n in baseline_updates), "对照里没有提前停止，测不出差别")
+        self.assertEqual(updates, baseline_updates)
+        np.testing.assert_allclose(lr_multipliers, baseline_lr_multipliers)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,63 @@
+import os
 import random
 import json
 import time
+import queue
+import threading
+import multiprocessing
 
 import numpy as np
-from collections import defaultdict, deque
+from collections import defaultdict
 from play import MCTSPlayer
+from cache import EvaluationCache
+from inference import InferenceServer
+from replay_buffer import ReplayBuffer, PersistentReplayBuffer
+from checkpoint import CheckpointManager
+from model import set_session_threads, freeze_graph_def, InferencePolicyValueNet
+
+
+def selfplay_worker(game, create_policy_value_net, c_puct, n_playout, temp, weight_queue, data_queue, seed, session_threads=0,
+                    inference_client=None):
+    """
+    在单独的进程里不停地自我对局，把每局的对局数据放进data_queue。
+    :param game: 具体某个游戏的Game对象
+    :param create_policy_value_net: 创建PolicyValueNet对象的函数，需要能被pickle
+    :param c_puct: 论文里面的c_puct
+    :param n_playout: 每步的蒙特卡洛搜索次数
+    :param temp: 论文里面的温度值
+    :param weight_queue: 收到神经网络的新参数就换上，收到None就退出
+    :param data_queue: 对局数据(state, mcts_probs, z)列表放到这里
+    :param seed: 随机数种子，每个进程不一样
+    :param session_threads: tensorflow的session用的线程数，0表示由tensorflow决定
+    :param inference_client: 不为None时不创建神经网络，用这个InferenceClient把棋局发给训练进程里的InferenceServer评估，
+        这时weight_queue只用来通知开始和退出
+    """
+    os.environ["CUDA_VISIBLE_DEVICES"] = ""  # 自我对局只用CPU，不占用训练用的GPU
+    data_queue.cancel_join_thread()  # 退出时不用等训练进程取走还没送出去的对局数据
+    random.seed(seed)
+    np.random.seed(seed)
+    if inference_client is None:
+        set_session_threads(session_threads, session_threads)
+        policy_value_net = create_policy_value_net()
+    else:
+        policy_value_net = inference_client
+    player = MCTSPlayer(policy_value_net.policy_value_fn, c_puct=c_puct, n_playout=n_playout, is_selfplay=True)
+    weights = weight_queue.get()
+    while weights is not None:
+        if inference_client is None:
+            policy_value_net.set_weights(weights)
+        while True:
+            try:
+                weights = weight_queue.get_nowait()  # 有新参数就换上
+                break
+            except queue.Empty:
+                winner, play_data = game.start_self_play(player, temp=temp)
+                data_queue.put(list(play_data))
 
 
 class Trainer:
+    lazy_augmentation = False  # 子类设为True时数据集里每个棋局只保存一次，取训练数据时再随机做一种对称变换
+
     def __init__(self, game, policy_value_net, save_dir,
                  learn_rate=2e-4,
                  temp=1.0,
@@ -18,7 +68,23 @@ class Trainer:
                  epochs=5,
                  check_freq=50,
                  play_batch_size=1,
-                 game_batch_num=100000):
+                 game_batch_num=100000,
+                 n_workers=0,
+                 create_policy_value_net=None,
+                 lockstep_selfplay=False,
+                 eval_cache_bytes=0,
+                 persistent_buffer=False,
+                 lazy_augmentation=None,
+                 kl_probe_size=0,
+                 async_training=False,
+                 sample_reuse=4.0,
+                 refresh_freq=10,
+                 keep_last=0,
+                 keep_every=0,
+                 freeze_graph=False,
+                 resume=False,
+                 worker_threads=1,
+                 shared_inference=False):
         """
         :param game: 具体某个游戏的Game对象
         :param policy_value_net: 具体某个游戏的PolicyValueNet对象
@@ -33,16 +99,42 @@ class Trainer:
         :param check_freq: 每玩多少批次就保存
         :param play_batch_size: 每批次游戏有多少局
         :param game_batch_num: 总共玩多少批次游戏
+        :param n_workers: 自我对局的进程数量，为0时在训练进程里自我对局
+        :param create_policy_value_net: 自我对局进程里创建PolicyValueNet对象的函数，需要能被pickle，例如functools.partial(GobangPolicyValueNet, 8)
+        :param lockstep_selfplay: 为True时每批次的play_batch_size局同时进行，所有局的叶子节点合并成一批交给神经网络评估
+        :param eval_cache_bytes: 大于0时在神经网络前面加一个最多占用这么多字节的评估缓存EvaluationCache，训练后自动清空
+        :param persistent_buffer: 是否把数据集保存在save_dir/replay_buffer目录里，重新启动训练时接着用原来的数据
+        :param lazy_augmentation: 是否在取训练数据时才做对称变换，而不是保存所有对称变换后的数据，为None时用类属性lazy_augmentation
+        :param kl_probe_size: 每次训练后只用这么多条数据计算KL，为0时用整批数据
+        :param async_training: 为True时学习线程一直从数据集取数据训练，同时自我对局一直产生数据，两者不再轮流进行
+        :param sample_reuse: 异步训练时每产生一条数据最多训练多少条数据，控制数据被重复使用的程度
+        :param refresh_freq: 异步训练时每训练多少次把神经网络的新参数发给自我对局进程
+        :param keep_last: 保留最近多少个检查点，更早的检查点只留下statistics.json，为0时全部保留
+        :param keep_every: 另外保留第几批次是它的倍数的检查点，为0时不按这个保留
+        :param freeze_graph: 保存检查点时是否同时生成*PretrainedPolicyValueNet用的graph.bytes
+        :param resume: 是否从save_dir里最近的检查点接着训练，载入模型参数（包括优化器的参数）和训练状态，最好和persistent_buffer一起用
+        :param worker_threads: 每个自我对局进程的session用的线程数，默认为1，避免很多进程的线程互相抢CPU，为0时由tensorflow决定
+        :param shared_inference: 为True时自我对局进程不各自创建神经网络，而是把棋局发给训练进程里的InferenceServer，
+            所有进程的棋局合并成一批用正在训练的神经网络评估，不需要create_policy_value_net
         """
         self.game = game
+        self.eval_cache_bytes = eval_cache_bytes  # 评估缓存最多占用的字节数
+        if eval_cache_bytes > 0:
+            policy_value_net = EvaluationCache(policy_value_net, max_bytes=eval_cache_bytes)
         self.policy_value_net = policy_value_net
+        self.selfplay_net = policy_value_net  # 训练进程里自我对局用的神经网络，异步训练时是参数的快照
+        self.snapshot_graph_def = None  # 学习线程生成的还没换上的快照
         self.save_dir = save_dir
 
         self.learn_rate = learn_rate  # 学习速率
         self.temp = temp  # 论文里面的温度值
         self.n_playout = n_playout  # 每步的蒙特卡洛搜索次数
         self.c_puct = c_puct  # 论文里面的c_puct。一个在范围(0, inf)的数字，控制探索等级。值越小越依赖于Q值，值越大越依赖于P值
-        self.data_buffer = deque(maxlen=buffer_size)
+        if persistent_buffer:
+            self.data_buffer = PersistentReplayBuffer(buffer_size, os.path.join(save_dir, "replay_buffer"))
+            print("data_buffer: resumed {} records".format(len(self.data_buffer)))
+        else:
+            self.data_buffer = ReplayBuffer(buffer_size)
         self.batch_size = batch_size  # 训练参数
         self.epochs = epochs  # 每次更新执行train_steps的次数
         self.check_freq = check_freq  # 每玩多少批次就保存
@@ -51,43 +143,213 @@ class Trainer:
 
         self.lr_multiplier = 1.0  # 根据KL调整学习速率
         self.kl_targ = 0.02
+        self.kl_probe_size = kl_probe_size  # 计算KL用的数据数量，为0时用整批数据
+
+        self.mcts_player = MCTSPlayer(self.selfplay_policy_value_fn, c_puct=self.c_puct, n_playout=self.n_playout, is_selfplay=True)
+
+        self.n_workers = n_workers  # 自我对局的进程数量
+        self.create_policy_value_net = create_policy_value_net
+        self.worker_threads = worker_threads  # 每个自我对局进程的session用的线程数
+        self.workers, self.weight_queues, self.data_queue = [], [], None
+        self.shared_inference = shared_inference
+        self.inference_server = None  # 自我对局进程共用的推理服务
+        if shared_inference and n_workers <= 0:
+            raise Exception('shared_inference需要自我对局进程')
+        if n_workers > 0 and create_policy_value_net is None and not shared_inference:
+            raise Exception('使用自我对局进程时需要提供create_policy_value_net')
+
+        self.symmetry = self.create_symmetry()  # 用来增加数据集数量的对称变换
+        if lazy_augmentation is not None:
+            self.lazy_augmentation = lazy_augmentation
+
+        self.lockstep_selfplay = lockstep_selfplay
+        self.lockstep_players = []  # 同时进行的每局各用一个MCTSPlayer
 
-        self.mcts_player = MCTSPlayer(self.policy_value_net.policy_value_fn, c_puct=self.c_puct, n_playout=self.n_playout, is_selfplay=True)
+        self.async_training = async_training
+        self.sample_reuse = sample_reuse  # 训练的数据数量和产生的数据数量的最大比例
+        self.refresh_freq = refresh_freq  # 每训练多少次发送一次参数
+        self.buffer_condition = threading.Condition()  # 保护数据集，放入新数据时通知学习线程
+        self.net_lock = threading.Lock()  # 训练和保存，发送参数不能同时进行
+        self.stop_event = threading.Event()  # 通知学习线程退出
+        self.n_generated = 0  # 放进数据集的数据数量
+        self.n_trained = 0  # 训练用过的数据数量
+        self.n_updates = 0  # 训练次数
+        self.loss, self.entropy = None, None  # 最近一次训练的损失函数值和熵值
+
+        self.checkpoints = CheckpointManager(self.policy_value_net, save_dir, keep_last=keep_last, keep_every=keep_every,
+                                             freeze=freeze_graph)  # 在后台线程里保存模型
+        self.start_batch = 0  # 从第几批次游戏开始玩
+        self.elapsed = 0.0  # 恢复训练前已经训练了多少秒
+        if resume:
+            self.resume()
+
+    def start_workers(self):
+        """
+        启动自我对局进程，并把神经网络当前的参数发给它们。共享推理服务时先启动InferenceServer，再通知它们开始。
+        """
+        context = multiprocessing.get_context("spawn")  # 不能fork已经创建了tensorflow session的进程
+        self.data_queue = context.Queue()
+        clients = [None] * self.n_workers
+        if self.shared_inference:  # 每个进程同时只有一个棋局在等结果，一批最多n_workers个
+            self.inference_server = InferenceServer(self.locked_policy_value, max_batch_size=self.n_workers)
+            clients = self.inference_server.create_clients(self.n_workers, context)
+            self.inference_server.start()
+        for i in range(self.n_workers):
+            weight_queue = context.Queue()
+            worker = context.Process(target=selfplay_worker, daemon=True,
+                                     args=(self.game, self.create_policy_value_net, self.c_puct, self.n_playout, self.temp,
+                                           weight_queue, self.data_queue, random.randrange(1 << 30), self.worker_threads,
+                                           clients[i]))
+            worker.start()
+            self.workers.append(worker)
+            self.weight_queues.append(weight_queue)
+        if self.inference_server is not None:
+            for weight_queue in self.weight_queues:
+                weight_queue.put([])  # 不用发参数，只通知开始
+        else:
+            self.push_weights()
+
+    def locked_policy_value(self, state_batch):
+        """
+        共享推理服务用的policy_value，拿着net_lock评估，一批棋局不会和训练同时进行，用的是同一份参数。
+        :param state_batch: 一堆棋局
+        :return: 一堆动作P值和局面V值
+        """
+        with self.net_lock:
+            return self.policy_value_net.policy_value(state_batch)
+
+    def push_weights(self):
+        """
+        把神经网络当前的参数发给所有自我对局进程，它们下完手上这一局后换上。共享推理服务时它们用的就是训练进程里的神经网络，不用发。
+        """
+        if self.inference_server is not None:
+            return
+        weights = self.policy_value_net.get_weights()
+        for weight_queue in self.weight_queues:
+            weight_queue.put(weights)
+
+    def stop_workers(self):
+        """
+        通知所有自我对局进程退出并等待它们结束。
+        """
+        for weight_queue in self.weight_queues:
+            weight_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=60)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers, self.weight_queues = [], []
+        if self.inference_server is not None:  # 自我对局进程下完最后一局前还要用它
+            self.inference_server.stop()
+            self.inference_server = None
+
+    def create_symmetry(self):
+        """
+        具体的游戏重写这个方法返回棋盘的Symmetry对象，get_equi_data用它来增加数据集数量。
+        :return: Symmetry对象，为None时不增加数据
+        """
+        return None
 
     def get_equi_data(self, play_data):
         """
-        通过翻转旋转这些等价替换来增加数据集数量。具体的游戏需要重写这个方法来实现。
+        通过翻转旋转这些等价替换来增加数据集数量，整局的数据一起用self.symmetry的所有对称变换变换。
         :param play_data: 原数据集
         :return: 增加后的数据集
         """
-        return play_data
+        if self.symmetry is None:
+            return play_data
+        return self.symmetry.augment(play_data)
+
+    def selfplay_policy_value_fn(self, board):
+        """
+        训练进程里自我对局用的神经网络函数，转给selfplay_net，换上新的快照后不用重新创建MCTSPlayer。
+        :param board: 棋局
+        :return: (action, probability)列表和v值
+        """
+        return self.selfplay_net.policy_value_fn(board)
+
+    def selfplay_policy_value(self, state_batch):
+        """
+        :param state_batch: 一堆棋局
+        :return: 用selfplay_net得到的一堆动作P值和局面V值
+        """
+        return self.selfplay_net.policy_value(state_batch)
+
+    def take_snapshot(self):
+        """
+        异步训练时在持有net_lock的线程里调用：把神经网络当前的参数合并进计算图，主线程下一局开始前换上。
+        """
+        self.snapshot_graph_def = freeze_graph_def(self.policy_value_net)
+
+    def refresh_selfplay_net(self):
+        """
+        主线程在两局之间调用：有新的快照时换成用它创建的InferencePolicyValueNet，一局里的所有搜索都用同一份参数，
+        也不会和学习线程的train_step同时用训练的session。
+        """
+        with self.net_lock:
+            graph_def, self.snapshot_graph_def = self.snapshot_graph_def, None
+        if graph_def is None:
+            return
+        old_net = self.selfplay_net
+        self.selfplay_net = InferencePolicyValueNet(graph_def, self.policy_value_net.state_buffer.shape[1:])
+        if self.eval_cache_bytes > 0:
+            self.selfplay_net = EvaluationCache(self.selfplay_net, max_bytes=self.eval_cache_bytes)
+        if old_net is not self.policy_value_net:
+            old_net.session.close()
 
     def collect_selfplay_data(self, n_games=1):
         """
         通过自我对局，为训练收集游戏数据。
         :param n_games: 玩游戏的局数
         """
+        if self.lockstep_selfplay and not self.workers:
+            while len(self.lockstep_players) < n_games:
+                self.lockstep_players.append(MCTSPlayer(self.selfplay_policy_value_fn, c_puct=self.c_puct,
+                                                        n_playout=self.n_playout, is_selfplay=True))
+            for winner, play_data in self.game.start_self_play_batch(self.lockstep_players[:n_games],
+                                                                     self.selfplay_policy_value, temp=self.temp):
+                self.store_play_data(play_data)
+            return
         for i in range(n_games):
-            winner, play_data = self.game.start_self_play(self.mcts_player, temp=self.temp)
-            play_data = list(play_data)[:]
-            self.episode_len = len(play_data)
+            if self.workers:  # 等自我对局进程送来一局
+                play_data = self.data_queue.get()
+            else:
+                winner, play_data = self.game.start_self_play(self.mcts_player, temp=self.temp)
+            self.store_play_data(play_data)
+
+    def store_play_data(self, play_data):
+        """
+        把一局的对局数据增加后放进数据集，并通知学习线程。
+        :param play_data: (state, mcts_probs, z)列表
+        """
+        play_data = list(play_data)
+        self.episode_len = len(play_data)
+        if not self.lazy_augmentation:
             play_data = self.get_equi_data(play_data)
+        with self.buffer_condition:
             self.data_buffer.extend(play_data)
+            self.n_generated += len(play_data)
+            self.buffer_condition.notify()
 
     def policy_update(self):
         """
         根据在自我对局中收集的游戏数据，训练神经网络。
         :return: 返回损失函数值和熵值
         """
-        mini_batch = random.sample(self.data_buffer, self.batch_size)
-        state_batch = [data[0] for data in mini_batch]
-        mcts_probs_batch = [data[1] for data in mini_batch]
-        winner_batch = [data[2] for data in mini_batch]
-        old_probs, old_v = self.policy_value_net.policy_value(state_batch)
+        with self.buffer_condition:  # 异步训练时自我对局可能正在放入数据
+            state_batch, mcts_probs_batch, winner_batch = self.data_buffer.sample(
+                self.batch_size, symmetry=self.symmetry if self.lazy_augmentation else None)
+        probe = slice(0, self.kl_probe_size or self.batch_size)  # 数据是随机取的，前kl_probe_size条就是一个随机子集
         for i in range(self.epochs):
-            loss, entropy = self.policy_value_net.train_step(state_batch, mcts_probs_batch, winner_batch, self.learn_rate*self.lr_multiplier)
-            new_probs, new_v = self.policy_value_net.policy_value(state_batch)
-            kl = np.mean(np.sum(old_probs * (np.log(old_probs + 1e-10) - np.log(new_probs + 1e-10)), axis=1))
+            if i == 0:  # 更新前的输出和第一次训练在同一次session.run里得到
+                loss, entropy, old_probs, old_v = self.policy_value_net.train_step(
+                    state_batch, mcts_probs_batch, winner_batch, self.learn_rate*self.lr_multiplier, return_policy_value=True)
+                old_probs, old_v = old_probs[probe], old_v[probe]
+            else:
+                loss, entropy = self.policy_value_net.train_step(state_batch, mcts_probs_batch, winner_batch, self.learn_rate*self.lr_multiplier)
+            # 每次更新后马上检查KL，偏离太远就不再更新，只用kl_probe_size条数据计算
+            new_probs, new_v = self.policy_value_net.policy_value(state_batch[probe])
+            kl = self.kl_divergence(old_probs, new_probs)
             if kl > self.kl_targ * 4:  # D_KL偏离太远
                 break
         # 调整学习速率
@@ -96,11 +358,22 @@ class Trainer:
         elif kl < self.kl_targ / 2 and self.lr_multiplier < 100:
             self.lr_multiplier *= 1.5
 
-        explained_var_old = (1 - np.var(np.array(winner_batch) - old_v.flatten()) / np.var(np.array(winner_batch)))
-        explained_var_new = (1 - np.var(np.array(winner_batch) - new_v.flatten()) / np.var(np.array(winner_batch)))
+        # 新旧两个值都在同样的前kl_probe_size条数据上算
+        winner_probe = np.array(winner_batch[probe])
+        explained_var_old = (1 - np.var(winner_probe - old_v.flatten()) / np.var(winner_probe))
+        explained_var_new = (1 - np.var(winner_probe - new_v.flatten()) / np.var(winner_probe))
         print("loss={}, entropy={}, kl={:.5f}, lr_multiplier={:.3f}, explained_var_old={:.3f}, explained_var_new={:.3f}".format
             (loss, entropy, kl, self.lr_multiplier, explained_var_old, explained_var_new))
         return loss, entropy
+
+    @staticmethod
+    def kl_divergence(old_probs, new_probs):
+        """
+        :param old_probs: 更新前的落子概率
+        :param new_probs: 更新后的落子概率
+        :return: 平均的D_KL(old_probs || new_probs)
+        """
+        return np.mean(np.sum(old_probs * (np.log(old_probs + 1e-10) - np.log(new_probs + 1e-10)), axis=1))
     """
     def policy_evaluate(self, n_games=10):
         current_mcts_player = MCTSPlayer(self.policy_value_net.policy_value_fn, c_puct=self.c_puct, n_playout=self.n_playout)
@@ -113,19 +386,164 @@ class Trainer:
         print("win: {}, lose: {}, tie: {}, win_ratio: {}".format(win_cnt[1], win_cnt[2], win_cnt[-1], win_ratio))
         return win_ratio
     """
+    def evaluate(self):
+        """
+        具体的游戏可以重写这个方法，让当前的神经网络和别的AI对局，返回的分数最高的检查点会一直保留。
+        :return: 评估分数，为None时不评估
+        """
+        return None
+
+    def get_state(self, batch_index, elapsed):
+        """
+        得到恢复训练需要的训练状态，和检查点一起保存在trainer_state.json里。
+        :param batch_index: 玩到第几批次游戏
+        :param elapsed: 一共训练了多少秒
+        :return: 可以转成json的字典
+        """
+        random_state = random.getstate()
+        numpy_random_state = np.random.get_state()
+        return {
+            "batch_index": batch_index,
+            "time": elapsed,
+            "lr_multiplier": self.lr_multiplier,
+            "n_generated": self.n_generated,
+            "n_trained": self.n_trained,
+            "n_updates": self.n_updates,
+            "random_state": [random_state[0], list(random_state[1]), random_state[2]],
+            "numpy_random_state": [numpy_random_state[0], numpy_random_state[1].tolist()] + list(numpy_random_state[2:]),
+        }
+
+    def set_state(self, state):
+        """
+        恢复get_state得到的训练状态。
+        :param state: get_state返回的字典
+        """
+        self.start_batch = state["batch_index"]
+        self.elapsed = state["time"]
+        self.lr_multiplier = state["lr_multiplier"]
+        self.n_generated, self.n_trained, self.n_updates = state["n_generated"], state["n_trained"], state["n_updates"]
+        version, internal_state, gauss_next = state["random_state"]
+        random.setstate((version, tuple(internal_state), gauss_next))
+        name, keys, pos, has_gauss, cached_gaussian = state["numpy_random_state"]
+        np.random.set_state((name, np.array(keys, dtype=np.uint32), pos, has_gauss, cached_gaussian))
+
+    def resume(self):
+        """
+        从最近的检查点恢复：只载入这一个检查点的模型参数和trainer_state.json。
+        没有trainer_state.json的旧检查点只载入模型参数，批次从目录名接着数。
+        """
+        model_path = self.checkpoints.latest_checkpoint()
+        if model_path is None:
+            print("resume: no checkpoint in " + self.save_dir)
+            return
+        self.policy_value_net.restore_model(model_path)
+        state_path = os.path.join(os.path.dirname(model_path), "trainer_state.json")
+        if os.path.exists(state_path):
+            with open(state_path) as file:
+                self.set_state(json.load(file))
+        else:
+            self.start_batch = int(os.path.basename(os.path.dirname(model_path)))
+        print("resume: {}, batch_i={}, lr_multiplier={:.3f}".format(model_path, self.start_batch, self.lr_multiplier))
+
+    def save_checkpoint(self, batch_index, loss, entropy, start_time):
+        """
+        把模型和统计数据交给后台线程保存到save_dir/batch_index目录。
+        :param batch_index: 玩到第几批次游戏
+        :param loss: 最近一次训练的损失函数值
+        :param entropy: 最近一次训练的熵值
+        :param start_time: 开始训练的时间
+        """
+        print("save model " + str(batch_index))
+        print("data_buffer: {} records, {:.1f} MB".format(len(self.data_buffer), self.data_buffer.nbytes() / 1024 / 1024))
+        if isinstance(self.selfplay_net, EvaluationCache):
+            print("evaluation cache: {}".format(self.selfplay_net.get_metrics()))
+        elapsed = time.time() - start_time
+        self.checkpoints.save(batch_index, {"loss": float(loss), "entropy": float(entropy), "time": elapsed},
+                              evaluation=self.evaluate(), trainer_state=self.get_state(batch_index, elapsed))
+
     def run(self):
+        if self.async_training:
+            self.run_async()
+            return
         try:
-            start_time = time.time()
-            for i in range(self.game_batch_num):
+            start_time = time.time() - self.elapsed
+            if self.n_workers > 0:
+                self.start_workers()
+            for i in range(self.start_batch, self.game_batch_num):
                 self.collect_selfplay_data(self.play_batch_size)
                 print("batch_i={}, episode_len={}".format(i+1, self.episode_len))
                 if len(self.data_buffer) > self.batch_size:
-                    loss, entropy = self.policy_update()
+                    with self.net_lock:  # 共享推理服务的线程也会用神经网络
+                        loss, entropy = self.policy_update()
                 if (i+1) % self.check_freq == 0:
-                    print("save model " + str(i+1))
-                    save_dir = self.save_dir + "/" + str(i+1)
-                    self.policy_value_net.save_model(save_dir + "/policy_value_net.model")
-                    with open(save_dir + "/statistics.json", "w") as file:
-                        json.dump({"loss": float(loss), "entropy": float(entropy), "time": time.time()-start_time}, file)
+                    self.save_checkpoint(i+1, loss, entropy, start_time)
+                    if self.workers:
+                        self.push_weights()
+        except KeyboardInterrupt:
+            print('\n\rquit')
+        finally:
+            if self.workers:
+                self.stop_workers()
+            self.checkpoints.close()
+
+    def can_train(self):
+        """
+        :return: 数据集里的数据是否够一批，并且训练的数据数量还没有超过产生的数据数量的sample_reuse倍
+        """
+        return len(self.data_buffer) > self.batch_size and self.n_trained < self.sample_reuse * self.n_generated
+
+    def learner_loop(self):
+        """
+        学习线程：数据够用时就取一批训练，每训练refresh_freq次把新参数发给自我对局进程（没有时给主线程生成新的快照），直到stop_event被设置。
+        """
+        while not self.stop_event.is_set():
+            with self.buffer_condition:
+                while not self.can_train() and not self.stop_event.is_set():
+                    self.buffer_condition.wait(0.1)
+            if self.stop_event.is_set():
+                break
+            with self.net_lock:
+                self.loss, self.entropy = self.policy_update()
+                self.n_trained += self.batch_size
+                self.n_updates += 1
+                if self.n_updates % self.refresh_freq == 0:
+                    if self.workers:
+                        self.push_weights()
+                    else:
+                        self.take_snapshot()
+
+    def run_async(self):
+        """
+        异步训练：主线程自我对局（或者从自我对局进程收数据）放进数据集，学习线程同时一直训练。
+        没有自我对局进程时，主线程的蒙特卡洛搜索用神经网络参数的快照，每局开始前换上学习线程最新生成的快照。
+        """
+        learner = threading.Thread(target=self.learner_loop, daemon=True)
+        try:
+            start_time = time.time() - self.elapsed
+            if self.n_workers > 0:
+                self.start_workers()
+            else:
+                self.take_snapshot()
+            learner.start()
+            for i in range(self.start_batch, self.game_batch_num):
+                if not self.workers:
+                    self.refresh_selfplay_net()
+                self.collect_selfplay_data(self.play_batch_size)
+                elapsed = time.time() - start_time
+                print("batch_i={}, episode_len={}, updates={}, generated {:.1f} samples/s, trained {:.1f} samples/s, reuse={:.2f}".format(
+                    i+1, self.episode_len, self.n_updates, self.n_generated / elapsed, self.n_trained / elapsed,
+                    self.n_trained / self.n_generated if self.n_generated else 0.0))
+                if (i+1) % self.check_freq == 0 and self.loss is not None:
+                    with self.net_lock:
+                        self.save_checkpoint(i+1, self.loss, self.entropy, start_time)
         except KeyboardInterrupt:
             print('\n\rquit')
+        finally:
+            self.stop_event.set()
+            with self.buffer_condition:
+                self.buffer_condition.notify()
+            if learner.is_alive():
+                learner.join()
+            if self.workers:
+                self.stop_workers()
+            self.checkpoints.close()